@@ -0,0 +1,147 @@
+# benchmark harness for the voting rules in voting.py
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import voting
+
+
+CULTURES = {  # phi, the dispersion of the Mallows model, is only used by mallows
+    "impartial": lambda n_agents, n_alternatives, seed, phi: voting.impartial_culture_profile(n_agents, n_alternatives, seed),
+    "mallows": lambda n_agents, n_alternatives, seed, phi: voting.mallows_profile(n_agents, n_alternatives, phi, seed),
+    "single_peaked": lambda n_agents, n_alternatives, seed, phi: voting.single_peaked_profile(n_agents, n_alternatives, seed),
+    "duplicates": lambda n_agents, n_alternatives, seed, phi: voting.duplicate_profile(n_agents, n_alternatives, 10, seed),
+    "tied": lambda n_agents, n_alternatives, seed, phi: voting.tied_profile(n_agents, n_alternatives, seed),
+}
+
+RULES = {
+    "dictatorship": lambda preferences, tie_break: voting.dictatorship(preferences, 1),
+    "scoring_rule": lambda preferences, tie_break: voting.scoring_rule(preferences, [2 ** position for position in range(len(preferences[1]))], tie_break),
+    "plurality": voting.plurality,
+    "veto": voting.veto,
+    "borda": voting.borda,
+    "harmonic": voting.harmonic,
+    "STV": voting.STV,
+}
+
+FORMS = {
+    "dict": lambda profile: profile.to_dict(),
+    "profile": lambda profile: profile,
+    "compressed": lambda profile: profile.compress(),
+}
+
+
+def measure(function, repeat):
+
+    """
+    Runs the function repeat times and returns its result, the best running time in seconds and the peak memory of one more run in bytes.
+    The peak memory is measured in a separate run, because tracing the allocations slows the function down.
+    """
+
+    best = None
+    for attempt in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, best, peak
+
+
+def run(n_values, m_values, cultures, rules, form, tie_break, repeat, seed, output, phi_values=(0.5,)):
+
+    """
+    Times every rule on a profile of every culture for every n and m (and of the Mallows culture for every phi), and times generate_preferences and range_voting
+    on a csv file of valuations with many equal values. Every measurement is written to output as one JSON line.
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        for n_agents in n_values:
+            for n_alternatives in m_values:
+                record = {"n": n_agents, "m": n_alternatives, "form": form, "tie_break": tie_break, "seed": seed}
+
+                path = os.path.join(directory, "valuations.csv")
+                with open(path, "w") as csv_file:
+                    for row in voting.random_valuations(n_agents, n_alternatives, max_value=3, seed=seed):
+                        csv_file.write(",".join(map(str, row)) + "\n")
+                for name, function in (("generate_preferences", lambda: len(voting.generate_preferences(path, compact=True))),
+                                       ("range_voting", lambda: voting.range_voting(path, tie_break))):
+                    result, seconds, peak = measure(function, repeat)
+                    output.write(json.dumps(dict(record, culture="valuations", phi=None, rule=name, seconds=seconds, peak_bytes=peak, result=result)) + "\n")
+
+                for culture in cultures:
+                    for phi in phi_values if culture == "mallows" else [None]:
+                        profile = FORMS[form](CULTURES[culture](n_agents, n_alternatives, seed, phi))
+                        for rule in rules:
+                            result, seconds, peak = measure(lambda: RULES[rule](profile, tie_break), repeat)
+                            output.write(json.dumps(dict(record, culture=culture, phi=phi, rule=rule, seconds=seconds, peak_bytes=peak, result=result)) + "\n")
+                        output.flush()
+
+
+def compare(baseline_path, current_path, threshold):
+
+    """
+    Prints the ratio of the running times of two result files for every measurement they share,
+    flagging the ones that got slower by more than the threshold. Returns the number of flagged measurements.
+    """
+
+    def load(path):
+        with open(path) as result_file:
+            records = [json.loads(line) for line in result_file if line.strip()]
+        return {(record["culture"], record.get("phi"), record["form"], record["n"], record["m"], record["rule"], record["tie_break"], record["seed"]): record
+                for record in records}
+
+    baseline = load(baseline_path)
+    current = load(current_path)
+    regressions = 0
+    for key in sorted(set(baseline) & set(current), key=str):
+        ratio = current[key]["seconds"] / max(baseline[key]["seconds"], 1e-9)
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  SLOWER"
+            regressions += 1
+        print(f"{'/'.join(map(str, key)):60} {baseline[key]['seconds']:10.4f}s {current[key]['seconds']:10.4f}s {ratio:7.2f}x{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the voting rules on synthetic profiles.")
+    parser.add_argument("--n", type=int, nargs="+", default=[1000, 10000, 100000], help="numbers of agents")
+    parser.add_argument("--m", type=int, nargs="+", default=[3, 10], help="numbers of alternatives")
+    parser.add_argument("--cultures", nargs="+", choices=sorted(CULTURES), default=sorted(CULTURES))
+    parser.add_argument("--phi", type=float, nargs="+", default=[0.5], help="dispersions of the Mallows culture, from 0 (identical rankings) to 1 (impartial)")
+    parser.add_argument("--rules", nargs="+", choices=list(RULES), default=list(RULES))
+    parser.add_argument("--form", choices=sorted(FORMS), default="profile", help="how the profile is given to the rules")
+    parser.add_argument("--tie-break", default="min")
+    parser.add_argument("--repeat", type=int, default=3, help="the best of this many runs is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="-", help="JSON lines file to write, - for standard output")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown ratio flagged by --compare")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return 1 if compare(*args.compare, args.threshold) else 0
+
+    tie_break = args.tie_break if args.tie_break in ("min", "max") else int(args.tie_break)
+    if args.output == "-":
+        run(args.n, args.m, args.cultures, args.rules, args.form, tie_break, args.repeat, args.seed, sys.stdout, args.phi)
+    else:
+        with open(args.output, "w") as output:
+            run(args.n, args.m, args.cultures, args.rules, args.form, tie_break, args.repeat, args.seed, output, args.phi)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,105 @@
+# load test of the asyncio election service in voting_service.py
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+import voting
+from voting_service import ElectionService, ServiceOverloaded
+
+
+def percentile(latencies, fraction):
+
+    """
+    Returns the latency below which the given fraction of the sorted latencies lie (the nearest-rank percentile).
+    """
+
+    if not latencies:
+        return None
+    return latencies[min(len(latencies) - 1, max(0, round(fraction * len(latencies)) - 1))]
+
+
+async def run(n_requests, concurrency, n_agents, n_alternatives, rules, n_distinct, tie_break, seed, service_options):
+
+    """
+    Sends n_requests requests to an ElectionService from concurrency clients at once, every request asking for the winner of a random rule
+    on one of n_distinct random profiles, and returns the latencies and the throughput as a dictionary.
+    Small elections go through evaluate, so they are micro-batched, and the other ones through the rule itself.
+    The fewer distinct profiles, the more identical requests run at the same time and are coalesced.
+    """
+
+    rng = random.Random(seed)
+    profiles = [voting.impartial_culture_profile(n_agents, n_alternatives, seed=rng.getrandbits(32)) for profile in range(n_distinct)]
+    requests = [(rng.choice(profiles), rng.choice(rules)) for request in range(n_requests)]
+    latencies = []
+    rejected = 0
+
+    async with ElectionService(**service_options) as service:
+        pending = iter(requests)
+
+        async def client():
+            nonlocal rejected
+            for preferences, rule in pending:  # the clients share the requests, so at most concurrency of them run at a time
+                start = time.perf_counter()
+                try:
+                    if n_agents <= service.batch_max_agents:
+                        await service.evaluate(preferences, rule, tie_break)
+                    else:
+                        await getattr(service, rule)(preferences, tie_break)
+                except ServiceOverloaded:
+                    rejected += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for client_number in range(concurrency)))
+        seconds = time.perf_counter() - start
+        stats = service.stats()
+
+    latencies.sort()
+    return {"requests": n_requests, "concurrency": concurrency, "n": n_agents, "m": n_alternatives, "rules": rules, "distinct": n_distinct,
+            "seconds": seconds, "throughput": len(latencies) / seconds, "rejected": rejected,
+            "p50": percentile(latencies, 0.50), "p90": percentile(latencies, 0.90), "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None, "service": stats}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the asyncio election service and report its latency percentiles.")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64, help="number of clients sending requests at the same time")
+    parser.add_argument("--n", type=int, default=20, help="number of agents of every election")
+    parser.add_argument("--m", type=int, default=5, help="number of alternatives of every election")
+    parser.add_argument("--rules", nargs="+", default=["plurality", "borda", "harmonic"])
+    parser.add_argument("--distinct", type=int, default=1000, help="number of distinct profiles the requests are drawn from")
+    parser.add_argument("--tie-break", default="min")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="threads or processes of the service")
+    parser.add_argument("--processes", action="store_true", help="run the rules in a process pool instead of a thread pool")
+    parser.add_argument("--max-concurrency", type=int, default=None)
+    parser.add_argument("--max-waiting", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--batch-delay", type=float, default=0.001)
+    parser.add_argument("--batch-max-agents", type=int, default=64)
+    parser.add_argument("--output", default="-", help="JSON lines file to append to, - for standard output")
+    args = parser.parse_args(argv)
+
+    tie_break = args.tie_break if args.tie_break in ("min", "max") else int(args.tie_break)
+    service_options = {"workers": args.workers, "processes": args.processes, "max_concurrency": args.max_concurrency, "max_waiting": args.max_waiting,
+                       "batch_size": args.batch_size, "batch_delay": args.batch_delay, "batch_max_agents": args.batch_max_agents}
+    record = asyncio.run(run(args.requests, args.concurrency, args.n, args.m, args.rules, args.distinct, tie_break, args.seed, service_options))
+
+    line = json.dumps(record) + "\n"
+    if args.output == "-":
+        sys.stdout.write(line)
+    else:
+        with open(args.output, "a") as output:
+            output.write(line)
+    print(f"p50 {record['p50'] * 1000:.2f} ms, p99 {record['p99'] * 1000:.2f} ms, {record['throughput']:.0f} requests/s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
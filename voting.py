@@ -1,6 +1,27 @@
 # written by mehrnaz miri
 
-def generate_preferences(values):
+import csv
+import heapq
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from collections.abc import Mapping
+from contextlib import nullcontext
+from fractions import Fraction
+from functools import partial
+from itertools import accumulate, chain, islice, permutations, repeat
+from itertools import compress as keep_selected  # renamed, because compress is also a parameter of generate_preferences and stream_profile
+from math import fsum, isfinite, lcm
+from operator import add, eq, itemgetter, lt, mul
+
+
+def generate_preferences(values, compact=False, compress=False):
 
     """
     inputs a set of numerical values that the agents have for the different alternatives and outputs a preference profile.
@@ -8,530 +29,3421 @@ def generate_preferences(values):
     PARAMETERS
     -----------
     values: 
-        The input values to the generate_preferences function is a worksheet corresponding to an xlsx file.
+        The input values to the generate_preferences function is a worksheet corresponding to an xlsx file,
+        or the path to an xlsx or csv file, which is then read as a stream (see read_valuations).
+
+    compact: (bool)
+        if True, the rankings are written straight into a PreferenceProfile instead of a dictionary.
+
+    compress: (bool)
+        if True, identical rankings are collapsed into a CompressedProfile.
 
     RETURNS
     -----------
         The output (the return) of the generate_preferences function is a dictionary where the keys are the agents and the values are lists that correspond to the preference orderings of those agents.
+        When compact is True, a PreferenceProfile holding the same rankings is returned instead, and when compress is True, a CompressedProfile.
     """
 
+    if compact or compress:  # building the compact profile chunk by chunk, without creating the intermediate dictionary
+        profile, _ = stream_profile(values, compress=compress, sums=False)  # the sums of the valuations are not needed
+        return profile
+
     preference_profile = {}  # creating an empty dictionary for preferences
     agent_number = 1
 
-    for agents in values.iter_rows(min_row=1, values_only=True):
+    for chunk in read_valuations(values):
+        with _phase("rank"):
+            n_alternatives = len(chunk[0])
+            if len(set(map(len, chunk))) == 1:  # the whole chunk is ranked at once, then cut into the preference orderings of the agents
+                rankings = rank_valuation_matrix(chunk)
+                for start in range(0, len(rankings), n_alternatives):
+                    preference_profile[agent_number] = rankings[start:start + n_alternatives].tolist()
+                    agent_number += 1
+                continue
+            for agents in chunk:
 
-        alternative_valuations = list(agents)
-        alternatives_with_valuation = list(zip(range(1, len(alternative_valuations) + 1), alternative_valuations))  # creating a list of alternatives with their valuation
-        alternatives_with_valuation.sort(key=lambda x: (x[1], x[0]), reverse=True)  # sorting the previous list so that the most prefered is first, and so on
-        preferences = [alternative[0] for alternative in alternatives_with_valuation]  # creating a list of alternatives only
-        preference_profile[agent_number] = preferences   # putting the alternative in a list alongside with the agent number corresponding to it
-        agent_number += 1
+                preference_profile[agent_number] = _rank_valuations(agents)   # putting the alternative in a list alongside with the agent number corresponding to it
+                agent_number += 1
 
     return (preference_profile)
 
 
-def dictatorship(preferences, agent):
-    
+def _valuation_rows(values):
+
     """
-    An agent is selected, and the winner is the alternative that this agent ranks first.
+    Yields the rows of valuations of a worksheet, or of an xlsx or csv file given by its path.
+    An xlsx file is opened in read-only mode and a csv file is read line by line, so neither is ever loaded as a whole.
+    """
+
+    if not isinstance(values, (str, os.PathLike)):  # a worksheet that is already open
+        yield from values.iter_rows(min_row=1, values_only=True)
+        return
+
+    if os.fspath(values).lower().endswith(".csv"):
+        with open(values, newline="") as csv_file:
+            for row in csv.reader(csv_file):
+                if row:  # skipping blank lines
+                    yield [_parse_value(cell) for cell in row]
+        return
+
+    import openpyxl  # only needed for xlsx files
+
+    workbook = openpyxl.load_workbook(values, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(min_row=1, values_only=True)
+    finally:
+        workbook.close()  # read-only workbooks keep the file open until they are closed
+
+
+def _parse_value(cell):
+
+    """
+    Turns a csv cell into a number, keeping integers as integers. Empty cells become None, as they do in a worksheet.
+    """
+
+    cell = cell.strip()
+    if not cell:
+        return None
+    try:
+        return int(cell)
+    except ValueError:
+        return float(cell)
+
+
+def read_valuations(values, chunk_size=10000):
+
+    """
+    Reads the valuations of the agents as a stream of fixed-size chunks, so that at most chunk_size rows are held in memory at a time.
 
     PARAMETERS
     -----------
-    preferences: (dict)
-        A preference profile represented by a dictionary.
+    values:
+        a worksheet corresponding to an xlsx file, or the path to an xlsx or csv file.
 
-    agent: (int)
-        an integer corresponding to an agent.
+    chunk_size: (int)
+        the largest number of rows in a chunk.
 
     RETURNS
     -----------
-    The return of the function is the winner.
+    it yields lists of at most chunk_size rows, every row holding the valuations of one agent for the alternatives 1 to m.
     """
 
-    try: 
-        agent = int(agent)
-        if agent not in preferences:  # error handling in case the inputted integer does not correspond to an agent
-            raise KeyError("input agent is not in preferences")
-        else:
-            dictators_preference = preferences[agent]
-            winner = dictators_preference[0]
-            return (winner)
-    except KeyError as ke:
-        print(f"ERROR HAS OCCURED: {ke}")
-    except Exception as exp:
-        print(f"ERROR HAS OCCURED: {exp}")
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer")
 
+    rows = _valuation_rows(values)
+    while True:
+        with _phase("read"):
+            chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        _count("rows_read", len(chunk))
+        yield chunk
+
+
+def stream_profile(values, chunk_size=10000, compress=False, sums=True):
 
-def scoring_rule(preferences, score_vector, tie_break):
-    
     """
-    For every agent, the function assigns the highest score in the scoring vector to the most preferred alternative of the agent,
-    the second highest score to the second most preferred alternative of the agent and so on,
-    and the lowest score to the least preferred alternative of the agent. In the end, it returns the alternative with the highest total score,
-    using the tie-breaking option to distinguish between alternatives with the same score.
+    Reads the valuations chunk by chunk and turns every chunk straight into compact preference orderings,
+    while keeping a running sum of the valuations of every alternative. Apart from the compact profile itself,
+    the memory used is bounded by the chunk size rather than by the size of the sheet.
 
     PARAMETERS
     -----------
-    preferences: (dict)
-        A preference profile represented by a dictionary.
+    values:
+        a worksheet corresponding to an xlsx file, or the path to an xlsx or csv file.
 
-    score_vector: (list)
-        a score vector of length m, i.e., equal to the number of alternatives, i.e., a list of length m containing positive floating numbers.
+    chunk_size: (int)
+        the largest number of rows held in memory at a time.
 
-    tie_break:
-        an option for the tie-breaking among possible winners.
-        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
-            max: Among the possible winning alternatives, select the one with the highest number.
-            min: Among the possible winning alternatives, select the one with the lowest number.
-            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+    compress: (bool)
+        if True, identical rankings are collapsed into a CompressedProfile.
+
+    sums: (bool)
+        if False, the valuations are only ranked, not summed.
 
     RETURNS
     -----------
-    it returns the alternative with the highest total score, using the tie-breaking option to distinguish between alternatives with the 
-    same score.
+    a tuple (profile, valuation_sums), where profile is a PreferenceProfile (or a CompressedProfile) and valuation_sums is a list
+    with the sum of the valuations of every alternative, the one of alternative 1 first (None when sums is False).
     """
 
-    try:  # error-handling code for the case when the length of the scoring vector is not m
-        if len(score_vector) != len(preferences[1]):
-            raise ValueError("Incorrect input")
-    except Exception as exp:
-        print(exp)
-        return False
-    
-    else:
-        score_vector.sort(reverse=True)  # sorting the score vector so that the highest score is first
-        agent_preference_scores = {}  # an empty dictionary to keep track of each score for each alternative
-        total_scores = {}  # an empty dictionary to add each new score to the previous
-        for alternative in preferences[1]:
-            total_scores[alternative] = 0
-        for pref_list in preferences.values():
-            score = 0
-            for alternative in pref_list:
-                agent_preference_scores[alternative] = score_vector[score]
-                score += 1
-                total_scores[alternative] += agent_preference_scores[alternative]
-
-        highest_score = max(total_scores.values())  # determining the highest score
-
-        # checking to see if there is a tie between the highest scores
-        repetition = 0
-        for score in total_scores.values():
-            if score == highest_score:
-                repetition += 1
-
-        if repetition > 1:  # if there is a tie, applies tie breaking rules
-            possible_winners = [alternative for alternative, score in total_scores.items() if score == highest_score]  # creates a list of possible winners
-            if tie_break == "min":
-                return min(possible_winners)
-            if tie_break == "max":
-                return max(possible_winners)
-            else:
-                try:  # error handling in case the input integer does not correspond to an agent
-                    if int(tie_break) not in preferences.keys():
-                        raise ValueError("Integer does not correspond to an agent")
-                except Exception as exp:
-                    print(f"ERROR HAS OCCURED: {exp}")
-                    return False
-                else:
-                    pref = preferences[tie_break]  # creating a list of the input agents preferences
-                    pref_index = []
-                    for alternative in possible_winners:  # loops through the preference list to see if any of those preferences is one of the possible winners
-                        if alternative in pref:  # if one of the possible winners, adds it to new list
-                            pref_index.append(pref.index(alternative))
-                    return pref[min(pref_index)]  # returns the possible winner with the highest score using min, as the list is not sorted by reverse
-                
-        else:  # if there isn't a tie, returns the alternative with the highest score
-            return max(total_scores, key=total_scores.get)
-
-
-def plurality(preferences, tie_break):
-      
+    valuation_sums = []
+
+    def ranked_chunks():  # every chunk ranked at once, with its inverse-rank arrays
+        for chunk in read_valuations(values, chunk_size):
+            if sums:
+                if not valuation_sums:
+                    valuation_sums.extend([0] for alternative in chunk[0])
+                with _phase("sum"):
+                    for alternative, column in enumerate(zip(*chunk)):  # adding the chunk to the running sums (see _add_to_sum)
+                        valuation_sums[alternative] = _add_to_sum(valuation_sums[alternative], column)
+            with _phase("rank"):
+                ranked = rank_valuation_matrix(chunk, positions=not compress)
+            yield len(chunk[0]), ranked
+
+    if compress:
+        profile = CompressedProfile.from_rankings(rankings[start:start + n_alternatives] for n_alternatives, rankings in ranked_chunks()
+                                                  for start in range(0, len(rankings), n_alternatives))
+        return profile, list(map(_sum_value, valuation_sums)) if sums else None
+
+    rankings = positions = None
+    for n_alternatives, (chunk_rankings, chunk_positions) in ranked_chunks():
+        if rankings is None:
+            rankings, positions = chunk_rankings, chunk_positions
+        else:
+            rankings.extend(chunk_rankings)
+            positions.extend(chunk_positions)
+    if rankings is None:
+        raise ValueError("a preference profile needs at least one agent")
+    profile = PreferenceProfile(rankings, n_alternatives, validate=False)  # the rankings are valid by construction, and their positions are already built
+    profile._positions = positions
+    return profile, list(map(_sum_value, valuation_sums)) if sums else None
+
+
+def _rank_valuations(agents):
+
     """
-    The winner is the alternative that appears the most times in the first position of the agents' preference orderings.
+    Turns the valuations of one agent (a row of the worksheet) into the preference ordering of that agent.
+    The most valued alternative is first, and equal valuations are ordered by the higher alternative number first.
+    """
+
+    alternative_valuations = list(agents)
+    alternatives_with_valuation = list(zip(range(1, len(alternative_valuations) + 1), alternative_valuations))  # creating a list of alternatives with their valuation
+    alternatives_with_valuation.sort(key=lambda x: (x[1], x[0]), reverse=True)  # sorting the previous list so that the most prefered is first, and so on
+    return [alternative[0] for alternative in alternatives_with_valuation]  # creating a list of alternatives only
+
+
+_NEXT_BYTE = bytes(range(1, 256)) + b"\0"  # the table that adds 1 to every byte of a "B" array in one call of bytes.translate
+
+
+def rank_valuation_matrix(rows, positions=False):
+
+    """
+    Ranks the valuations of many agents at once, giving the same preference orderings as generate_preferences.
+    Every row is ranked by one stable sort of the alternatives, taken from the highest number down and keyed directly on the row,
+    so equal valuations keep the higher alternative number first, and no tuple is built and no key function runs in Python.
+    The inverse-rank arrays can be built in the same pass, so that a PreferenceProfile made from the result needs no positions pass.
 
     PARAMETERS
     -----------
-    preferences: (dict)
-        A preference profile represented by a dictionary.
+    rows: (list)
+        the valuations of the agents, one row of m values per agent, such as a chunk of read_valuations.
 
-    tie_break:
-        an option for the tie-breaking among possible winners.
-        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
-            max: Among the possible winning alternatives, select the one with the highest number.
-            min: Among the possible winning alternatives, select the one with the lowest number.
-            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+    positions: (bool)
+        if True, the inverse-rank arrays are returned as well.
 
     RETURNS
     -----------
-    it returns the winner of the Plurality rule, using the tie-breaking option to distinguish between possible winners.
+    an array holding the preference orderings one after the other, in the layout of PreferenceProfile.rankings.
+    If positions is True, a tuple (rankings, positions) where positions holds the position of every alternative for every agent,
+    in the layout of PreferenceProfile.positions.
     """
 
-    first_count = {}  # an empty list to keep track of how many times an alternative was in first place for each agent
+    if not rows:
+        return (array("B"), array("B")) if positions else array("B")
+    n_alternatives = len(rows[0])
+    if len(set(map(len, rows))) != 1:
+        raise ValueError("every row must hold the valuations of the same alternatives")
+    typecode = _smallest_typecode(n_alternatives)
+
+    order = range(n_alternatives - 1, -1, -1)  # the alternatives from the highest, as indices of the row, so the stable sort keeps ties in that order
+    ranked = [sorted(order, key=row.__getitem__, reverse=True) for row in rows]
+    rankings = array(typecode, chain.from_iterable(ranked))
+    if typecode == "B":  # turning the indices into alternatives numbered from 1
+        rankings = array("B", rankings.tobytes().translate(_NEXT_BYTE))
+    else:
+        rankings = array(typecode, map(add, rankings, repeat(1)))
+    if not positions:
+        return rankings
+    inverse = array(typecode, chain.from_iterable([sorted(range(n_alternatives), key=ranking.__getitem__) for ranking in ranked]))
+    return rankings, inverse
 
-    for pref_list in preferences.values():
-        first_preference = pref_list[0]
-        if first_preference not in first_count:
-            first_count[first_preference] = 1
-        else:
-            first_count[first_preference] += 1
 
-    max_score = max(first_count.values())
-    possible_winners = [alternative for alternative, score in first_count.items() if score == max_score]  # creating a list of possible winners
+def _smallest_typecode(largest):
+
+    """
+    Returns the smallest unsigned array typecode that can store every integer from 0 up to largest.
+    """
+
+    for typecode in "BHIL":
+        if largest < 2 ** (8 * array(typecode).itemsize):
+            return typecode
+    return "Q"
 
-    if len(possible_winners) == 1:
-        return possible_winners[0]
-    
-    else:  # if there is a tie, apply tie breaking rules
-        if tie_break == "min":
-            return min(possible_winners)
-        elif tie_break == "max":
-            return max(possible_winners)
-        else:
-            try:  # error handling in case input number does not correspond to an agent
-                if int(tie_break) not in preferences.keys():
-                    raise ValueError("Integer does not correspond to an agent")
-            except Exception as exp:
-                print(f"ERROR HAS OCCURED: {exp}")
-                return False
-            else:
-                pref = preferences[tie_break]  # creating a list of the input agents preferences
-                pref_index = []
-                for alternative in possible_winners:  # loops through the preference list to see if any of those preferences is one of the possible winners
-                    if alternative in pref:  # if one of the possible winners, adds it to new list
-                        pref_index.append(pref.index(alternative))
-                return pref[min(pref_index)]   # returns the possible winner with the highest score using min, as the list is not sorted by reverse
-        
 
-def veto(preferences, tie_break):
+class PreferenceProfile(Mapping):
 
     """
-    Every agent assigns 0 points to the alternative that they rank in the last place of their preference orderings, 
-    and 1 point to every other alternative. The winner is the alternative with the most number of points.
+    A preference profile where the rankings of all n agents are stored in one contiguous integer array of length n*m,
+    using the smallest integer type that fits m. Alongside it, an inverse array stores the position of every alternative for every agent.
+
+    The profile behaves like the dictionary returned by generate_preferences: the keys are the agents (1 to n)
+    and profile[agent] is the preference ordering of that agent as a list. Every voting rule in this module accepts it directly.
 
     PARAMETERS
     -----------
-    preferences: (dict)
-        A preference profile represented by a dictionary.
+    rankings: (array)
+        the n*m alternatives, agent after agent, most preferred first. Alternatives are the integers 1 to m.
+        A memoryview of the same integer type (such as a memory-mapped file) is used as it is, without copying it.
 
-    tie_break:
-        an option for the tie-breaking among possible winners.
-        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
-            max: Among the possible winning alternatives, select the one with the highest number.
-            min: Among the possible winning alternatives, select the one with the lowest number.
-            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+    n_alternatives: (int)
+        the number of alternatives m.
 
-    RETURNS
-    -----------
-    it returns the winner of the veto rule, using the tie-breaking option to distinguish between possible winners.
+    validate: (bool)
+        if False, the rankings are trusted to be rankings of the alternatives 1 to m and are not checked,
+        and the inverse array is only built the first time it is used. load_profile uses this for files written by save_profile.
     """
 
-    scores = {}  # creating an empty list to keep track of scores
-    
-    for pref_list in preferences.values():
-        last_ranked = pref_list[-1]
-        if last_ranked not in scores:  # initializing the last ranked
-            scores[last_ranked] = 0
-        else:
-            scores[last_ranked] += 0  # last rank getting a score of 0
+    def __init__(self, rankings, n_alternatives, validate=True):
 
-        for alternative in pref_list[:-1]:  # iterating through the list, without considering the last ranked
-            if alternative not in scores:  # initializing the other alternatives
-                scores[alternative] = 1
-            else:
-                scores[alternative] += 1  # adding one score
-                
-    max_score = max(scores.values())
-    possible_winners = [alternative for alternative, score in scores.items() if score == max_score]  # creating a list of possible winners
+        if n_alternatives < 1 or len(rankings) % n_alternatives != 0:
+            raise ValueError("rankings do not split into preference orderings of length m")
 
-    if len(possible_winners) == 1:  # if there isn't a tie, return the only item in the list of possible winners
-        return possible_winners[0]
-    
-    else:  # in case of tie, tie breaking rules apply
-        if tie_break == "min":
-            return min(possible_winners)
-        elif tie_break == "max":
-            return max(possible_winners)
+        self.n_alternatives = n_alternatives
+        self.n_agents = len(rankings) // n_alternatives
+        self.typecode = _smallest_typecode(n_alternatives)
+        if isinstance(rankings, array) and rankings.typecode == self.typecode or isinstance(rankings, memoryview) and rankings.format == self.typecode:
+            self.rankings = rankings
         else:
-            try:
-                if int(tie_break) not in preferences.keys():
-                    raise ValueError("Alternative does not correspond to an agent")
-            except Exception as exp:
-                print(f"ERROR HAS OCCURED: {exp}")
-                return False
-            else:
-                pref = preferences[tie_break]
-                pref_index = []
-                for alternative in possible_winners:
-                    if alternative in pref:
-                        pref_index.append(pref.index(alternative))
-                return pref[min(pref_index)]
-            
+            self.rankings = array(self.typecode, rankings)
+        self._positions = None
+        self.path = None  # the file the profile is memory-mapped from, set by load_profile
+
+        if validate:
+            self._build_positions(check=True)
+
+    def _build_positions(self, check=False):
+
+        """
+        Builds the inverse array, where positions[(i - 1) * m + a - 1] is the position of alternative a for agent i,
+        checking on the way that every agent ranks every alternative exactly once.
+        """
+
+        n_alternatives = self.n_alternatives
+        alternatives = list(range(1, n_alternatives + 1))
+        positions = array(self.typecode, bytes(len(self.rankings) * array(self.typecode).itemsize))
+        for start in range(0, len(self.rankings), n_alternatives):
+            ranking = self.rankings[start:start + n_alternatives]
+            if check and sorted(ranking) != alternatives:
+                raise ValueError(f"preference ordering of agent {start // n_alternatives + 1} is not a ranking of the alternatives 1 to {n_alternatives}")
+            positions[start:start + n_alternatives] = array(self.typecode, sorted(range(n_alternatives), key=ranking.__getitem__))
+        self._positions = positions
+
+    @property
+    def positions(self):
+        if self._positions is None:
+            self._build_positions()
+        return self._positions
+
+    @classmethod
+    def from_rankings(cls, rankings):
+
+        """
+        Builds a profile from an iterable of preference orderings (lists of alternatives), the first one belonging to agent 1.
+        The rankings are consumed one at a time, so a generator never has to be held in memory as a whole.
+        """
+
+        flat = None
+        n_alternatives = 0
+        for ranking in rankings:
+            if flat is None:
+                n_alternatives = len(ranking)
+                flat = array(_smallest_typecode(n_alternatives))
+            elif len(ranking) != n_alternatives:
+                raise ValueError("all preference orderings must have the same length")
+            flat.extend(ranking)
+        if flat is None:
+            raise ValueError("a preference profile needs at least one agent")
+        return cls(flat, n_alternatives)
+
+    @classmethod
+    def from_dict(cls, preferences):
+
+        """
+        Builds a profile from a dictionary such as the one returned by generate_preferences. The agents must be numbered 1 to n.
+        """
+
+        if sorted(preferences) != list(range(1, len(preferences) + 1)):
+            raise ValueError("the agents must be numbered 1 to n")
+        return cls.from_rankings(preferences[agent] for agent in range(1, len(preferences) + 1))
+
+    def __getitem__(self, agent):
+        if not isinstance(agent, int) or not 1 <= agent <= self.n_agents:
+            raise KeyError(agent)
+        start = (agent - 1) * self.n_alternatives
+        return self.rankings[start:start + self.n_alternatives].tolist()
+
+    def __iter__(self):
+        return iter(range(1, self.n_agents + 1))
 
-def borda(preferences, tie_break):
+    def __len__(self):
+        return self.n_agents
+
+    def __repr__(self):
+        return f"PreferenceProfile(n_agents={self.n_agents}, n_alternatives={self.n_alternatives})"
+
+    def position(self, agent, alternative):
+
+        """
+        Returns the position (0 for the most preferred) of the alternative in the preference ordering of the agent.
+        """
+
+        if agent not in self:
+            raise KeyError(agent)
+        return self.positions[(agent - 1) * self.n_alternatives + alternative - 1]
+
+    def column(self, position):
+
+        """
+        Returns an array with the alternative that every agent ranks at the given position, agent 1 first.
+        Position 0 gives the first choices and position -1 the last choices.
+        """
+
+        if position < 0:
+            position += self.n_alternatives
+        return self.rankings[position::self.n_alternatives]
+
+    def first_choices(self):
+        return self.column(0)
+
+    def last_choices(self):
+        return self.column(-1)
+
+    @property
+    def nbytes(self):
+        return (len(self.rankings) + (0 if self._positions is None else len(self._positions))) * self.rankings.itemsize
+
+    def to_dict(self):
+
+        """
+        Returns the profile as a dictionary in the format returned by generate_preferences.
+        """
+
+        return {agent: self[agent] for agent in self}
+
+    def compress(self):
+
+        """
+        Returns a CompressedProfile where the identical rankings of this profile are collapsed into (ranking, count) pairs.
+        """
+
+        return CompressedProfile.from_rankings(self.rankings[start:start + self.n_alternatives] for start in range(0, len(self.rankings), self.n_alternatives))
+
+
+class CompressedProfile(Mapping):
 
     """
-    Every agent assigns a score of 0 to the their least-preferred alternative (the one at the bottom of the preference ranking),
-    a score of 1 to the second least-preferred alternative, ... , and a score of m - 1 to their favourite alternative.
-    In other words, the alternative ranked at position j receives a score of m - j. The winner is the alternative with the highest score.
+    An anonymous preference profile where identical rankings are collapsed into distinct ballots with multiplicities.
+    The distinct ballots are stored in a PreferenceProfile (ballot b being its agent b + 1) and their counts in an integer array,
+    so the voting rules tally over the distinct ballots weighted by their counts instead of over every agent.
+
+    The profile still behaves like the dictionary returned by generate_preferences: profile[agent] is the preference ordering of that agent,
+    looked up through the mapping from agents to ballots, so dictatorship and the agent tie-breaking keep working.
 
     PARAMETERS
     -----------
-    preferences: (dict)
-        A preference profile represented by a dictionary.
+    ballots: (PreferenceProfile)
+        the distinct rankings.
 
-    tie_break:
-        an option for the tie-breaking among possible winners.
-        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
-            max: Among the possible winning alternatives, select the one with the highest number.
-            min: Among the possible winning alternatives, select the one with the lowest number.
-            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+    counts: (array)
+        the number of agents that submitted each ballot.
 
-    RETURNS
+    agent_ballot: (array)
+        the ballot (0 for the first ballot) of every agent, agent 1 first.
+        If None, the agents are numbered ballot after ballot: the first counts[0] agents submitted the first ballot, and so on.
+    """
+
+    def __init__(self, ballots, counts, agent_ballot=None):
+
+        if len(counts) != ballots.n_agents:
+            raise ValueError("there must be exactly one count for every ballot")
+
+        self.ballots = ballots
+        self.counts = counts if isinstance(counts, (array, memoryview)) else array(_smallest_typecode(max(counts)), counts)
+        self.path = None  # the file the profile is memory-mapped from, set by load_profile
+        self.agent_ballot = agent_ballot
+        self.n_ballots = ballots.n_agents
+        self.n_alternatives = ballots.n_alternatives
+        self.n_agents = sum(self.counts)
+        self._ends = None if agent_ballot is not None else list(accumulate(self.counts))  # the agent number after the last agent of every ballot
+
+        if agent_ballot is not None and len(agent_ballot) != self.n_agents:
+            raise ValueError("there must be exactly one ballot for every agent")
+
+    @classmethod
+    def from_rankings(cls, rankings):
+
+        """
+        Builds a compressed profile from an iterable of preference orderings, the first one belonging to agent 1.
+        Only the distinct rankings are stored, together with the ballot of every agent.
+        """
+
+        ballot_numbers = {}  # the ballot number of every distinct ranking seen so far
+        counts = []
+        agent_ballot = []
+        for ranking in rankings:
+            key = tuple(ranking)
+            ballot = ballot_numbers.setdefault(key, len(ballot_numbers))
+            if ballot == len(counts):  # a ranking that has not been seen before
+                counts.append(0)
+            counts[ballot] += 1
+            agent_ballot.append(ballot)
+        if not counts:
+            raise ValueError("a preference profile needs at least one agent")
+        ballots = PreferenceProfile.from_rankings(ballot_numbers)
+        return cls(ballots, counts, array(_smallest_typecode(len(counts)), agent_ballot))
+
+    @classmethod
+    def from_counts(cls, weighted_rankings):
+
+        """
+        Builds a compressed profile from (ranking, count) pairs. The agents are numbered ballot after ballot.
+        """
+
+        weighted_rankings = list(weighted_rankings)
+        ballots = PreferenceProfile.from_rankings(ranking for ranking, count in weighted_rankings)
+        return cls(ballots, [count for ranking, count in weighted_rankings])
+
+    def ballot_of(self, agent):
+
+        """
+        Returns the ballot (0 for the first ballot) submitted by the agent.
+        """
+
+        if not isinstance(agent, int) or not 1 <= agent <= self.n_agents:
+            raise KeyError(agent)
+        if self.agent_ballot is not None:
+            return self.agent_ballot[agent - 1]
+        return bisect_right(self._ends, agent - 1)
+
+    def weighted_ballots(self):
+
+        """
+        Yields every distinct ranking together with the number of agents that submitted it.
+        """
+
+        for ballot, count in enumerate(self.counts, start=1):
+            yield self.ballots[ballot], count
+
+    def __getitem__(self, agent):
+        return self.ballots[self.ballot_of(agent) + 1]
+
+    def __iter__(self):
+        return iter(range(1, self.n_agents + 1))
+
+    def __len__(self):
+        return self.n_agents
+
+    def __repr__(self):
+        return f"CompressedProfile(n_agents={self.n_agents}, n_ballots={self.n_ballots}, n_alternatives={self.n_alternatives})"
+
+    def to_dict(self):
+
+        """
+        Returns the profile as a dictionary in the format returned by generate_preferences.
+        """
+
+        return {agent: self[agent] for agent in self}
+
+
+_PROFILE_MAGIC = b"VOTEPRF1"
+_PROFILE_HEADER = struct.Struct("<8sQQQccccBBB5x")  # magic, number of rankings, m, number of agents, byte order, 3 typecodes and 3 item sizes
+
+
+def save_profile(preferences, path):
+
+    """
+    Writes a preference profile to a binary file that load_profile can memory-map.
+    The file holds a header (the number of rankings, m, the number of agents and the integer types),
+    the raw ranking matrix and, for a CompressedProfile, the ballot multiplicities and the ballot of every agent.
+
+    PARAMETERS
     -----------
-    it returns the winner of the borda rule, using the tie-breaking option to distinguish between possible winners.
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    path:
+        the path of the file to write.
     """
 
-    scores = {}  # creating an empty list of scores for each iteration
-    total_scores = {}  # creating a list to keep track of the scores
+    counts = agent_ballot = None
+    if isinstance(preferences, CompressedProfile):
+        counts = array("Q", preferences.counts)
+        agent_ballot = preferences.agent_ballot
+        preferences = preferences.ballots
+    elif not isinstance(preferences, PreferenceProfile):
+        preferences = PreferenceProfile.from_dict(preferences)
 
-    for pref_list in preferences.values():
-        length = len(pref_list)
-        for n in range(-1, -length-1, -1):  # going through the alternatives in the preference list -1 by -1, basically in reverse, creating a recrusion loop
-            if n == -1:
-                scores[pref_list[n]] = 0  # if it's the least favored, gets a score of 0
-                total_scores[pref_list[n]] = total_scores.get(pref_list[n], 0) + scores[pref_list[n]]  # adds it to previously attained scores for that alternative
-            else:
-                scores[pref_list[n]] = scores[pref_list[n+1]] + 1
-                total_scores[pref_list[n]] = scores[pref_list[n]] + total_scores.get(pref_list[n], 0)
+    sections = [preferences.rankings] + [section for section in (counts, agent_ballot) if section is not None]
+    typecodes = [getattr(section, "typecode", None) or section.format for section in sections] + ["\0"] * (3 - len(sections))
+    itemsizes = [section.itemsize for section in sections] + [0] * (3 - len(sections))
+    n_agents = 0 if counts is None else sum(counts)
+    flags = 0 if agent_ballot is None else 1
 
-    max_score = max(total_scores.values())
-    possible_winners = [alternative for alternative, score in total_scores.items() if score == max_score]
+    with open(path, "wb") as profile_file:
+        profile_file.write(_PROFILE_HEADER.pack(_PROFILE_MAGIC, preferences.n_agents, preferences.n_alternatives, n_agents,
+                                                sys.byteorder[0].encode(), *(typecode.encode() for typecode in typecodes), *itemsizes))
+        for section in sections:
+            data = section.tobytes()
+            profile_file.write(data)
+            profile_file.write(bytes(-len(data) % 8))  # every section starts on a multiple of 8 bytes
+
+
+def load_profile(path, memory_map=True):
 
-    if len(possible_winners) == 1:
-        return possible_winners[0]
-    
-    else:
-        if tie_break == "min":
-            return min(possible_winners)
-        elif tie_break == "max":
-            return max(possible_winners)
-        else:
-            try:
-                if int(tie_break) not in preferences.keys():
-                    raise ValueError("Alternative does not correspond to an agent")
-            except Exception as exp:
-                print(f"ERROR HAS OCCURED: {exp}")
-                return False
-            else:
-                pref = preferences[tie_break]
-                pref_index = []
-                for alternative in possible_winners:
-                    if alternative in pref:
-                        pref_index.append(pref.index(alternative))
-                return pref[min(pref_index)]
-        
-        
-def harmonic(preferences, tie_break):
-    
     """
-    Every agent assigns a score of 1/m to the their least-preferred alternative (the one at the bottom of the preference ranking),
-    a score of 1/(m-1) to the second least-preferred alternative, ... , and a score of 1 to their favourite alternative.
-    In other words, the alternative ranked at position j receives a score of 1/j . The winner is the alternative with the highest score.
+    Reads a preference profile written by save_profile. By default the file is memory-mapped, so opening it takes the same time
+    whatever its size, the voting rules run directly on the mapped pages without copying them, and processes that load the same file share its pages.
 
     PARAMETERS
     -----------
-    preferences: (dict)
-        A preference profile represented by a dictionary.
+    path:
+        the path of a file written by save_profile.
 
-    tie_break:
-        an option for the tie-breaking among possible winners.
-        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
-            max: Among the possible winning alternatives, select the one with the highest number.
-            min: Among the possible winning alternatives, select the one with the lowest number.
-            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+    memory_map: (bool)
+        if False, the file is read into memory instead.
 
     RETURNS
     -----------
-    it returns the winner of the harmonic rule, using the tie-breaking option to distinguish between possible winners.
+    a PreferenceProfile, or a CompressedProfile when the file holds ballot multiplicities.
     """
 
-    scores = {}  # creates a list of scores for each iteration
-    total_scores = {}  # creating a list to keep track of scores
-
-    for pref_list in preferences.values():
-        length = len(pref_list)
-        for n in range(0, length):  # loops through the preferences of each agent
-            scores[pref_list[n]] = 1/(n+1)
-            total_scores[pref_list[n]] = scores[pref_list[n]] + total_scores.get(pref_list[n], 0)  # adds the newly attained score to the previous ones for that alternative
-            
-    max_score = max(total_scores.values())
-    possible_winners = [alternative for alternative, score in total_scores.items() if score == max_score]
-
-    if len(possible_winners) == 1:
-        return possible_winners[0]
-    
-    else:
-        if tie_break == "min":
-            return min(possible_winners)
-        elif tie_break == "max":
-            return max(possible_winners)
+    with open(path, "rb") as profile_file:
+        if memory_map:
+            buffer = memoryview(mmap.mmap(profile_file.fileno(), 0, access=mmap.ACCESS_READ))
         else:
-            try:
-                if int(tie_break) not in preferences.keys():
-                    raise ValueError("Alternative does not correspond to an agent")
-            except Exception as exp:
-                print(f"ERROR HAS OCCURED: {exp}")
-                return False
-            else:
-                pref = preferences[tie_break]
-                pref_index = []
-                for alternative in possible_winners:
-                    if alternative in pref:
-                        pref_index.append(pref.index(alternative))
-                return pref[min(pref_index)]
+            buffer = memoryview(profile_file.read())
+
+    if len(buffer) < _PROFILE_HEADER.size:
+        raise ValueError(f"{path} is not a preference profile file")
+    magic, n_rankings, n_alternatives, n_agents, byteorder, *fields = _PROFILE_HEADER.unpack_from(buffer)
+    typecodes = [typecode.decode() for typecode in fields[:3]]
+    itemsizes = fields[3:]
+    if magic != _PROFILE_MAGIC:
+        raise ValueError(f"{path} is not a preference profile file")
+    if byteorder != sys.byteorder[0].encode():
+        raise ValueError(f"{path} was written on a machine with a different byte order")
+
+    sections = []
+    offset = _PROFILE_HEADER.size
+    for typecode, itemsize, length in zip(typecodes, itemsizes, (n_rankings * n_alternatives, n_rankings, n_agents)):
+        if typecode == "\0":
+            break
+        if array(typecode).itemsize != itemsize:
+            raise ValueError(f"{path} uses {itemsize}-byte integers for typecode {typecode}, which this platform does not have")
+        sections.append(buffer[offset:offset + length * itemsize].cast(typecode))
+        offset += length * itemsize + (-length * itemsize % 8)
+
+    profile = PreferenceProfile(sections[0], n_alternatives, validate=False)
+    if len(sections) > 1:
+        profile = CompressedProfile(profile, sections[1], sections[2] if len(sections) > 2 else None)
+    profile.path = path if memory_map else None  # lets worker processes map the same file instead of receiving the rankings
+    return profile
+
+
+def position_counts(preferences, positions=None):
 
-
-def STV(preferences, tie_break):
- 
     """
-    The voting rule works in rounds. In each round, the alternatives that appear
-    the least frequently in the first position of agents' rankings are removed, and the process is repeated. When the final set of alternatives
-    is removed (one or possibly more), then this last set is the set of possible winners.
+    Builds the m x m matrix that counts how many agents rank each alternative at each position, in a single pass over the profile.
 
     PARAMETERS
     -----------
-    preferences: (dict)
-        A preference profile represented by a dictionary.
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
 
-    tie_break:
-        an option for the tie-breaking among possible winners.
-        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
-            max: Among the possible winning alternatives, select the one with the highest number.
-            min: Among the possible winning alternatives, select the one with the lowest number.
-            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+    positions: (list)
+        if given, only the rows of these positions are counted, and the rows of the other positions are None.
 
     RETURNS
     -----------
-    it returns the winner of the Single Transferable Vote rule, using the tie-breaking option to distinguish between possible winners.
+    a list of m lists, where counts[j][a - 1] is the number of agents that rank alternative a at position j (0 for the most preferred).
     """
 
-    count = {}  # creating a list to keep track of how many times an alternative is least frequently the first
+    if isinstance(preferences, CompressedProfile):  # counting every distinct ballot once, weighted by the number of agents that submitted it
+        return _flat_position_counts(preferences.ballots.rankings, preferences.n_alternatives, preferences.counts, positions)
+    if isinstance(preferences, PreferenceProfile):
+        return _flat_position_counts(preferences.rankings, preferences.n_alternatives, None, positions)
 
-    for pref_list in preferences.values():
-        for alternative in pref_list:
-            if alternative not in count:
-                count[alternative] = 0  # initializes the count list for each alternative
+    n_alternatives = len(next(iter(preferences.values())))
+    counts = [None] * n_alternatives
+    for position in range(n_alternatives) if positions is None else positions:
+        column_count = Counter(map(itemgetter(position), preferences.values()))
+        counts[position] = [column_count[alternative] for alternative in range(1, n_alternatives + 1)]
+    return counts
 
-    for pref_list in preferences.values():  # creates a loop to count how many times each alternative has been in the first place
-        first_ranked = pref_list[0]
-        if first_ranked not in count:
-            count[first_ranked] = 1
-        else:
-            count[first_ranked] += 1
-
-    while min(count.values()) != max(count.values()):  # creates a loop that will go on until there are only alternatives with the highest score remaining
-        least_frequent = min(count.values())
-        removed = []  # creates a list of least frequent alternatives
-        for alternative, alt_count in count.items():
-            if alt_count == least_frequent:
-                removed.append(alternative)  # adds the least frequent alternative to the to be removed list
-        for pref_list in preferences.values():
-            for least_alternative in removed:
-                if least_alternative in pref_list:  # finds the least frequent alternative in the pref list and removes it
-                    while least_alternative in pref_list:
-                        pref_list.remove(least_alternative)
-                    if pref_list:  # after removing, adds one score to the next first place
-                        count[pref_list[0]] += 1
-        for alternative in removed:  # removes the least frequent alternative from the count dictionary as well
-            del count[alternative]
-
-    possible_winners = list(count.keys())  # creates a list of possible winners
-
-    if len(possible_winners) == 1:
-        return possible_winners[0]
 
-    else:
-        if tie_break == "min":
-            return min(possible_winners)
-        elif tie_break == "max":
-            return max(possible_winners)
-        else:
-            try:
-                if int(tie_break) not in preferences.keys():
-                    raise ValueError("Alternative does not correspond to an agent")
-            except Exception as exp:
-                print(f"ERROR HAS OCCURED: {exp}")
-                return False
-            else:
-                pref = preferences[tie_break]
-                pref_index = []
-                for alternative in possible_winners:
-                    if alternative in pref:
-                        pref_index.append(pref.index(alternative))
-                return pref[min(pref_index)]
+def _flat_position_counts(rankings, n_alternatives, weights=None, positions=None):
 
+    """
+    Counts the positions of the alternatives in an array holding the rankings one after the other, every column being a slice of the array.
+    When weights are given, every ranking is counted as many times as its weight.
+    """
+
+    counts = [None] * n_alternatives
+    for position in range(n_alternatives) if positions is None else positions:
+        column = rankings[position::n_alternatives]
+        if weights is not None:
+            row = [0] * n_alternatives
+            for alternative, weight in zip(column, weights):
+                row[alternative - 1] += weight
+            counts[position] = row
+        elif getattr(column, "itemsize", None) == 1:  # one byte per alternative (an array or a memory-mapped view), so the bytes can be counted directly
+            column_bytes = column.tobytes()
+            counts[position] = [column_bytes.count(alternative) for alternative in range(1, n_alternatives + 1)]
+        else:
+            column_count = Counter(column)
+            counts[position] = [column_count[alternative] for alternative in range(1, n_alternatives + 1)]
+    return counts
 
 
-def range_voting(values, tie_break):
+def positional_scores(counts, score_vector):
 
     """
-    Sums the numerical values in an xlsx file, and chooses the alternative with the maximum sum as the winner.
+    Returns the total score of every alternative as the product of the position count matrix with the score vector.
 
     PARAMETERS
     -----------
-    values:
-        a worksheet corresponding to an xlsx file
+    counts: (list)
+        the position count matrix returned by position_counts.
 
-    tie_break:
-        an option for the tie-breaking among possible winners.
-        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
-            max: Among the possible winning alternatives, select the one with the highest number.
-            min: Among the possible winning alternatives, select the one with the lowest number.
-            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+    score_vector: (list)
+        the score given to the alternative at each position, the first score going to the most preferred alternative.
 
     RETURNS
     -----------
-    The function should return the alternative that has the maximum sum of valuations, i.e.,
-    the maximum sum of numerical values in the xlsx file, using the tie-breaking option to distinguish between possible winners.
+    a dictionary where the keys are the alternatives and the values are their total scores.
     """
 
-    worksheet = values
-    preferences = generate_preferences(values)  # turns the preference profile in the xlsx file into a dictionary
-    max_val = 0
-    agents_pref = []  # creates a list of the agents preferences valuations
+    return {alternative: sum(map(mul, column, score_vector)) for alternative, column in enumerate(zip(*counts), start=1)}
 
-    for row in worksheet.values:  # iterates through each row in the worksheet and adds it as a list to agents_pref
-        agents_pref.append(list(row))
 
-    length = len(agents_pref[0])
-    valuation = [0]*length  # creates and initializes a new list with the length of l
+def _profile_scores(preferences, score_vector):
 
-    for alternative in range(length):  # iterates through each alternative and adds their values together
-        for val in agents_pref:
-            valuation[alternative] += val[alternative]
+    """
+    Returns the total score of every alternative, counting only the positions whose score differs from the most common score.
+    Every agent ranks every alternative exactly once, so the most common score is simply given n times to every alternative.
+    Plurality then only counts the first position and veto only the last one.
+    """
 
-    max_val = max(valuation)
-    possible_winners = [alternative + 1 for alternative in range(len(valuation)) if valuation[alternative] == max_val]  # creates a list of possible winners
+    common_score = Counter(score_vector).most_common(1)[0][0]
+    counts = position_counts(preferences, [position for position, score in enumerate(score_vector) if score != common_score])
+    return _counted_scores(counts, len(preferences), score_vector)
 
-    if len(possible_winners) == 1:  # check for ties in possible winners
-        return possible_winners[0]
 
-    else:  # applies tie breaking rules in case of a tie
-        if tie_break == "min":
-            return min(possible_winners)
-        elif tie_break == "max":
-            return max(possible_winners)
+def _counted_scores(counts, n_agents, score_vector):
+
+    """
+    Returns the total scores of _profile_scores from a position count matrix, adding the scores in the same order,
+    so that float scores give exactly the same totals.
+    """
+
+    common_score = Counter(score_vector).most_common(1)[0][0]
+    counted = [position for position, score in enumerate(score_vector) if score != common_score]
+    base_score = n_agents * common_score
+    total_scores = dict.fromkeys(range(1, len(score_vector) + 1), base_score)
+    for position in counted:
+        extra_score = score_vector[position] - common_score
+        for alternative, count in enumerate(counts[position], start=1):
+            total_scores[alternative] += count * extra_score
+    return total_scores
+
+
+def positional_winner(preferences, score_vector, tie_break, output="winner", k=None):
+
+    """
+    The engine shared by scoring_rule, plurality, veto, borda and harmonic. It counts the positions of the alternatives once,
+    scores them with the score vector and returns the alternative with the highest total score, using the tie-breaking option
+    to distinguish between alternatives with the same score.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    score_vector: (list)
+        the score given to the alternative at each position, the first score going to the most preferred alternative.
+
+    tie_break:
+        an option for the tie-breaking among possible winners (max, min or an agent).
+
+    output: (str)
+        what to return: winner, scores, ranking or top (see scoring_rule).
+
+    k: (int)
+        the number of alternatives returned when output is top.
+
+    RETURNS
+    -----------
+    it returns the winner, using the tie-breaking option to distinguish between possible winners, or what output asks for.
+    """
+
+    _check_output(output, k)
+    with _phase("tally"):
+        total_scores = _profile_scores(preferences, score_vector)
+    _count("ballots_touched", _n_ballots(preferences))
+    return _rule_output(total_scores, preferences, tie_break, output, k)
+
+
+def rule_score_vector(rule, n_alternatives):
+
+    """
+    Returns the score vector of a positional rule for m alternatives, the first score going to the most preferred alternative.
+
+    PARAMETERS
+    -----------
+    rule: (str)
+        one of plurality, veto, borda and harmonic.
+
+    n_alternatives: (int)
+        the number of alternatives m.
+
+    RETURNS
+    -----------
+    a list of m scores.
+    """
+
+    if rule == "plurality":
+        return [1] + [0] * (n_alternatives - 1)  # one point for the first position only
+    if rule == "veto":
+        return [1] * (n_alternatives - 1) + [0]  # one point for every position but the last
+    if rule == "borda":
+        return list(range(n_alternatives - 1, -1, -1))  # m - 1 points for the first position, down to 0 for the last
+    if rule == "harmonic":
+        return [Fraction(1, position) for position in range(1, n_alternatives + 1)]  # exact fractions, so ties are never lost to rounding
+    raise ValueError(f"{rule} is not a positional rule")
+
+
+def evaluate_all(preferences, rules, tie_break):
+
+    """
+    Evaluates several rules on the same profile, scanning the profile once to build the position count matrix they share
+    (its first row holds the first-choice counts). Every positional rule is then a product of the count matrix with its score vector.
+    STV still runs its own elimination rounds.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    rules: (list)
+        the rules to evaluate: plurality, veto, borda, harmonic, STV, condorcet, copeland and maximin by name,
+        and custom scoring rules by their score vector.
+
+    tie_break:
+        an option for the tie-breaking among possible winners (max, min or an agent), used for every rule.
+
+    RETURNS
+    -----------
+    a dictionary where the keys are the rules (a score vector becomes a tuple) and the values are tuples (winner, scores).
+    For a positional or pairwise rule, scores is a dictionary with the score of every alternative (see condorcet_scores,
+    copeland_scores and maximin_scores). For STV, scores is the elimination trace returned by stv_elimination.
+    """
+
+    n_alternatives = len(preferences[1])
+    score_vectors = {}
+    for rule in rules:  # checking every rule before the profile is scanned
+        if isinstance(rule, str):
+            if rule != "STV" and rule not in PAIRWISE_RULES:
+                score_vectors[rule] = rule_score_vector(rule, n_alternatives)
+        elif len(rule) != n_alternatives:
+            raise ValueError(f"score vector {list(rule)} does not have length {n_alternatives}")
+        else:
+            score_vectors[tuple(rule)] = sorted(rule, reverse=True)  # the highest score goes to the most preferred alternative
+
+    if not isinstance(tie_break, TieBreaker):  # one tie-breaker, so the inverse-rank index of an agent is built once for all the rules
+        tie_break = TieBreaker(preferences, tie_break)
+    with _phase("tally"):
+        counts = position_counts(preferences) if score_vectors else None  # the single scan shared by all positional rules
+    if score_vectors:
+        _count("ballots_touched", _n_ballots(preferences))
+    majority = pairwise_counts(preferences) if any(rule in PAIRWISE_RULES for rule in rules if isinstance(rule, str)) else None  # shared by the pairwise rules
+
+    results = {}
+    for rule in rules:
+        key = rule if isinstance(rule, str) else tuple(rule)
+        if key == "STV":
+            possible_winners, scores = stv_elimination(preferences)
+        elif key in PAIRWISE_RULES:
+            scores, possible_winners = _pairwise_possible_winners(key, majority)
+        else:
+            scores = positional_scores(counts, score_vectors[key])
+            highest_score = max(scores.values())
+            possible_winners = [alternative for alternative, score in scores.items() if score == highest_score]
+        results[key] = (_break_tie(possible_winners, preferences, tie_break) if possible_winners else None, scores)  # condorcet may have no winner
+    return results
+
+
+class TieBreaker:
+
+    """
+    Breaks ties among possible winners with a tie-breaking option, or with a chain of options applied in order.
+    The options are max, min and an agent: among the possible winners, the agent option selects the one that the agent ranks the highest.
+    For every agent that is asked about, the position of every alternative (its inverse-rank index) is built once, the first time,
+    so that every possible winner is then compared in constant time. The same TieBreaker can serve several rules on the same profile.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    tie_break:
+        max, min, an agent, or a list of these options, such as [3, 7, "min"]: agent 3 breaks the tie, then agent 7 breaks what is left of it
+        (when an agent does not rank every possible winner), then min. If possible winners are still tied at the end of the chain, min is used.
+    """
+
+    def __init__(self, preferences, tie_break):
+        self.preferences = preferences
+        self.chain = list(tie_break) if isinstance(tie_break, (list, tuple)) else [tie_break]
+        self.rank_indexes = {}  # the inverse-rank index of every agent asked about so far
+
+    def rank_index(self, agent):
+
+        """
+        Returns a dictionary with the position of every alternative that the agent ranks (0 for the most preferred).
+        """
+
+        if agent not in self.rank_indexes:
+            self.rank_indexes[agent] = {alternative: position for position, alternative in enumerate(self.preferences[agent])}
+        return self.rank_indexes[agent]
+
+    def select(self, possible_winners):
+
+        """
+        Returns the winner among the possible winners. It returns False when an option of the chain does not correspond to an agent.
+        """
+
+        _count("tie_breaks")
+        candidates = list(possible_winners)
+        with _phase("tie_break"):
+            for option in self.chain:
+                if len(candidates) == 1:
+                    break
+                if option == "min":
+                    return min(candidates)
+                elif option == "max":
+                    return max(candidates)
+                try:  # error handling in case the input integer does not correspond to an agent
+                    agent = int(option)
+                    if agent not in self.preferences.keys():
+                        raise ValueError("Integer does not correspond to an agent")
+                except Exception as exp:
+                    _report_error("tie_break", exp, option=option)
+                    return False
+                rank_index = self.rank_index(agent)
+                ranked = [alternative for alternative in candidates if alternative in rank_index]
+                if ranked:  # keeping the possible winner that the agent ranks the highest
+                    candidates = [min(ranked, key=rank_index.__getitem__)]
+        return min(candidates)
+
+    def agents(self):
+
+        """
+        Returns the agents of the chain, i.e., the agents whose preference orderings may be needed.
+        """
+
+        agents = []
+        for option in self.chain:
+            if option not in ("min", "max"):
+                try:
+                    agents.append(int(option))
+                except (TypeError, ValueError):  # reported by select if it is ever reached
+                    pass
+        return agents
+
+
+def _break_tie(possible_winners, preferences, tie_break):
+
+    """
+    Selects the winner among the possible winners using the tie-breaking option (max, min, an agent or a chain of them, see TieBreaker).
+    tie_break can also be a TieBreaker, to share the inverse-rank indexes between several rules.
+    It returns False when the tie-breaking option does not correspond to an agent.
+    """
+
+    if len(possible_winners) == 1:  # there is no tie, so the only possible winner is the winner
+        return possible_winners[0]
+    if not isinstance(tie_break, TieBreaker):
+        tie_break = TieBreaker(preferences, tie_break)
+    return tie_break.select(possible_winners)
+
+
+_OUTPUTS = ("winner", "scores", "ranking", "top")  # what a rule can return
+
+
+def _check_output(output, k):
+    if output not in _OUTPUTS:
+        raise ValueError(f"output must be one of {', '.join(_OUTPUTS)}, not {output!r}")
+    if output == "top" and (not isinstance(k, int) or k < 1):
+        raise ValueError("output top needs a positive number of alternatives k")
+
+
+def _score_tiers(scores, lowest_first=False):
+
+    """
+    Returns the social ordering given by the scores as a list of tiers, the best tier first,
+    every tier being the sorted list of the alternatives with the same score.
+    """
+
+    tiers = {}
+    for alternative, score in scores.items():
+        tiers.setdefault(score, []).append(alternative)
+    return [sorted(tiers[score]) for score in sorted(tiers, reverse=not lowest_first)]
+
+
+def _break_tiers(tiers, preferences, tie_break, k=None):
+
+    """
+    Turns a list of tiers into a strict ordering of the alternatives (only the first k when k is given),
+    ordering every tier by selecting its winner with the tie-breaking option again and again.
+    It returns False when the tie-breaking option does not correspond to an agent.
+    """
+
+    if not isinstance(tie_break, TieBreaker):
+        tie_break = TieBreaker(preferences, tie_break)
+    order = []
+    for tier in tiers:
+        if k is not None and len(order) >= k:
+            break
+        remaining = list(tier)
+        while len(remaining) > 1 and (k is None or len(order) < k):
+            selected = tie_break.select(remaining)
+            if selected is False:
+                return False
+            order.append(selected)
+            remaining.remove(selected)
+        order.extend(remaining)
+    return order if k is None else order[:k]
+
+
+def _rule_output(scores, preferences, tie_break, output, k, lowest_first=False):
+
+    """
+    Returns what a rule was asked for, from the score of every alternative: the winner, the scores themselves, the social ordering
+    as a list of tiers (see _score_tiers), or the k best alternatives. For the top k, the k-th best score is found by partial selection,
+    so only the alternatives that score at least as well are sorted and tie-broken.
+    lowest_first is True for the rules where a lower score is better.
+    """
+
+    if output == "scores":
+        return scores
+    if output == "ranking":
+        return _score_tiers(scores, lowest_first)
+    if output == "top":
+        if k < len(scores):
+            threshold = (heapq.nsmallest if lowest_first else heapq.nlargest)(k, scores.values())[-1]
+            scores = {alternative: score for alternative, score in scores.items() if (score <= threshold if lowest_first else score >= threshold)}
+        return _break_tiers(_score_tiers(scores, lowest_first), preferences, tie_break, k)
+    best_score = min(scores.values()) if lowest_first else max(scores.values())
+    possible_winners = [alternative for alternative, score in scores.items() if score == best_score]  # creating a list of possible winners
+    return _break_tie(possible_winners, preferences, tie_break)
+
+
+def dictatorship(preferences, agent):
+    
+    """
+    An agent is selected, and the winner is the alternative that this agent ranks first.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    agent: (int)
+        an integer corresponding to an agent.
+
+    RETURNS
+    -----------
+    The return of the function is the winner.
+    """
+
+    try: 
+        agent = int(agent)
+        if agent not in preferences:  # error handling in case the inputted integer does not correspond to an agent
+            raise KeyError("input agent is not in preferences")
+        else:
+            dictators_preference = preferences[agent]
+            winner = dictators_preference[0]
+            return (winner)
+    except KeyError as ke:
+        _report_error("dictatorship", ke, agent=agent)
+    except Exception as exp:
+        _report_error("dictatorship", exp, agent=agent)
+
+
+def scoring_rule(preferences, score_vector, tie_break, output="winner", k=None):
+    
+    """
+    For every agent, the function assigns the highest score in the scoring vector to the most preferred alternative of the agent,
+    the second highest score to the second most preferred alternative of the agent and so on,
+    and the lowest score to the least preferred alternative of the agent. In the end, it returns the alternative with the highest total score,
+    using the tie-breaking option to distinguish between alternatives with the same score.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    score_vector: (list)
+        a score vector of length m, i.e., equal to the number of alternatives, i.e., a list of length m containing positive floating numbers.
+
+    tie_break:
+        an option for the tie-breaking among possible winners.
+        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
+            max: Among the possible winning alternatives, select the one with the highest number.
+            min: Among the possible winning alternatives, select the one with the lowest number.
+            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+        A list of these options, such as [3, 7, "min"], is a chain that is applied in order (see TieBreaker).
+
+    output: (str)
+        what to return: winner (the default), scores (the total score of every alternative), ranking (the social ordering as a list of tiers,
+        the best first, every tier holding the alternatives with the same score) or top (the k best alternatives, ties broken with the tie-breaking option).
+
+    k: (int)
+        the number of alternatives returned when output is top.
+
+    RETURNS
+    -----------
+    it returns the alternative with the highest total score, using the tie-breaking option to distinguish between alternatives with the 
+    same score.
+    If output is scores, ranking or top, it returns the scores, the social ordering or the list of the k best alternatives instead.
+    """
+
+    try:  # error-handling code for the case when the length of the scoring vector is not m
+        if len(score_vector) != len(preferences[1]):
+            raise ValueError("Incorrect input")
+    except Exception as exp:
+        _report_error("scoring_rule", exp, length=len(score_vector))
+        return False
+
+    else:
+        return positional_winner(preferences, sorted(score_vector, reverse=True), tie_break, output, k)  # the highest score goes to the most preferred alternative
+
+
+def plurality(preferences, tie_break, output="winner", k=None):
+      
+    """
+    The winner is the alternative that appears the most times in the first position of the agents' preference orderings.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    tie_break:
+        an option for the tie-breaking among possible winners.
+        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
+            max: Among the possible winning alternatives, select the one with the highest number.
+            min: Among the possible winning alternatives, select the one with the lowest number.
+            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+        A list of these options, such as [3, 7, "min"], is a chain that is applied in order (see TieBreaker).
+
+    output: (str)
+        what to return: winner (the default), scores (the total score of every alternative), ranking (the social ordering as a list of tiers,
+        the best first, every tier holding the alternatives with the same score) or top (the k best alternatives, ties broken with the tie-breaking option).
+
+    k: (int)
+        the number of alternatives returned when output is top.
+
+    RETURNS
+    -----------
+    it returns the winner of the Plurality rule, using the tie-breaking option to distinguish between possible winners.
+    If output is scores, ranking or top, it returns the scores, the social ordering or the list of the k best alternatives instead.
+    """
+
+    n_alternatives = len(preferences[1])
+    return positional_winner(preferences, rule_score_vector("plurality", n_alternatives), tie_break, output, k)
+
+
+def veto(preferences, tie_break, output="winner", k=None):
+
+    """
+    Every agent assigns 0 points to the alternative that they rank in the last place of their preference orderings, 
+    and 1 point to every other alternative. The winner is the alternative with the most number of points.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    tie_break:
+        an option for the tie-breaking among possible winners.
+        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
+            max: Among the possible winning alternatives, select the one with the highest number.
+            min: Among the possible winning alternatives, select the one with the lowest number.
+            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+        A list of these options, such as [3, 7, "min"], is a chain that is applied in order (see TieBreaker).
+
+    output: (str)
+        what to return: winner (the default), scores (the total score of every alternative), ranking (the social ordering as a list of tiers,
+        the best first, every tier holding the alternatives with the same score) or top (the k best alternatives, ties broken with the tie-breaking option).
+
+    k: (int)
+        the number of alternatives returned when output is top.
+
+    RETURNS
+    -----------
+    it returns the winner of the veto rule, using the tie-breaking option to distinguish between possible winners.
+    If output is scores, ranking or top, it returns the scores, the social ordering or the list of the k best alternatives instead.
+    """
+
+    n_alternatives = len(preferences[1])
+    return positional_winner(preferences, rule_score_vector("veto", n_alternatives), tie_break, output, k)
+
+
+def borda(preferences, tie_break, output="winner", k=None):
+
+    """
+    Every agent assigns a score of 0 to the their least-preferred alternative (the one at the bottom of the preference ranking),
+    a score of 1 to the second least-preferred alternative, ... , and a score of m - 1 to their favourite alternative.
+    In other words, the alternative ranked at position j receives a score of m - j. The winner is the alternative with the highest score.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    tie_break:
+        an option for the tie-breaking among possible winners.
+        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
+            max: Among the possible winning alternatives, select the one with the highest number.
+            min: Among the possible winning alternatives, select the one with the lowest number.
+            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+        A list of these options, such as [3, 7, "min"], is a chain that is applied in order (see TieBreaker).
+
+    output: (str)
+        what to return: winner (the default), scores (the total score of every alternative), ranking (the social ordering as a list of tiers,
+        the best first, every tier holding the alternatives with the same score) or top (the k best alternatives, ties broken with the tie-breaking option).
+
+    k: (int)
+        the number of alternatives returned when output is top.
+
+    RETURNS
+    -----------
+    it returns the winner of the borda rule, using the tie-breaking option to distinguish between possible winners.
+    If output is scores, ranking or top, it returns the scores, the social ordering or the list of the k best alternatives instead.
+    """
+
+    n_alternatives = len(preferences[1])
+    return positional_winner(preferences, rule_score_vector("borda", n_alternatives), tie_break, output, k)
+
+
+def harmonic(preferences, tie_break, output="winner", k=None):
+    
+    """
+    Every agent assigns a score of 1/m to the their least-preferred alternative (the one at the bottom of the preference ranking),
+    a score of 1/(m-1) to the second least-preferred alternative, ... , and a score of 1 to their favourite alternative.
+    In other words, the alternative ranked at position j receives a score of 1/j . The winner is the alternative with the highest score.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    tie_break:
+        an option for the tie-breaking among possible winners.
+        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
+            max: Among the possible winning alternatives, select the one with the highest number.
+            min: Among the possible winning alternatives, select the one with the lowest number.
+            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+        A list of these options, such as [3, 7, "min"], is a chain that is applied in order (see TieBreaker).
+
+    output: (str)
+        what to return: winner (the default), scores (the total score of every alternative), ranking (the social ordering as a list of tiers,
+        the best first, every tier holding the alternatives with the same score) or top (the k best alternatives, ties broken with the tie-breaking option).
+
+    k: (int)
+        the number of alternatives returned when output is top.
+
+    RETURNS
+    -----------
+    it returns the winner of the harmonic rule, using the tie-breaking option to distinguish between possible winners.
+    If output is scores, ranking or top, it returns the scores, the social ordering or the list of the k best alternatives instead.
+
+    EXAMPLE
+    -----------
+    The scores are exact fractions, so alternatives 1 and 3, which both score 1 + 1 + 1/2 + 1/3, are tied and the tie-breaking decides
+    (added as floats, the totals differed by rounding and alternative 3 won):
+
+    >>> harmonic({1: [3, 2, 1], 2: [3, 1, 2], 3: [1, 3, 2], 4: [1, 2, 3]}, "min")
+    1
+    """
+
+    n_alternatives = len(preferences[1])
+    return positional_winner(preferences, rule_score_vector("harmonic", n_alternatives), tie_break, output, k)
+
+
+def stv_elimination(preferences):
+
+    """
+    Runs the rounds of the Single Transferable Vote without changing the preference profile.
+    Every ballot keeps a pointer to its current top alternative, and the ballots are kept in buckets indexed by their current top.
+    When alternatives are eliminated, only the ballots in their buckets are touched: their pointers move past the eliminated
+    alternatives and they join the bucket of their new top, so the whole run takes close to linear time.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    RETURNS
+    -----------
+    a tuple (possible_winners, trace). possible_winners is the last set of alternatives that is removed.
+    trace has one entry per round, a tuple (counts, removed) where counts is a dictionary with the number of first places
+    of every remaining alternative at the start of the round and removed is the list of alternatives eliminated in that round.
+    The last round removes the possible winners.
+    """
+
+    weights = None
+    if isinstance(preferences, CompressedProfile):  # every distinct ballot is counted once, weighted by the number of agents that submitted it
+        weights = preferences.counts
+        preferences = preferences.ballots
+    if isinstance(preferences, PreferenceProfile):  # the ballots are consecutive slices of the ranking array
+        flat = preferences.rankings
+        n_alternatives = preferences.n_alternatives
+        ends = range(n_alternatives, len(flat) + 1, n_alternatives)
+        alternatives = range(1, n_alternatives + 1)
+    else:
+        flat = [alternative for pref_list in preferences.values() for alternative in pref_list]
+        ends = list(accumulate(len(pref_list) for pref_list in preferences.values()))
+        alternatives = sorted(set(flat))
+
+    with _phase("stv"):
+        count = dict.fromkeys(alternatives, 0)  # the number of first places of every remaining alternative
+        buckets = {alternative: array("L") for alternative in alternatives}  # the ballots whose current top is the alternative
+        pointers = array("Q", chain([0], ends[:-1]))  # the position of the current top of every ballot in flat
+
+        for ballot, start in enumerate(pointers):
+            if start < ends[ballot]:  # an empty ballot never counts
+                buckets[flat[start]].append(ballot)
+        for alternative, bucket in buckets.items():
+            count[alternative] = len(bucket) if weights is None else sum(weights[ballot] for ballot in bucket)
+
+        eliminated = set()
+        trace = []
+        moved = 0  # the number of times a ballot moved to a new top, for the instrumentation
+        while min(count.values()) != max(count.values()):  # the rounds go on until there are only alternatives with the same count remaining
+            least_frequent = min(count.values())
+            removed = [alternative for alternative, alt_count in count.items() if alt_count == least_frequent]
+            trace.append((dict(count), removed))
+            eliminated.update(removed)
+            for alternative in removed:
+                del count[alternative]
+            for alternative in removed:  # moving only the ballots whose current top was eliminated to their next remaining alternative
+                bucket = buckets.pop(alternative)
+                moved += len(bucket)
+                for ballot in bucket:
+                    position = pointers[ballot] + 1
+                    end = ends[ballot]
+                    while position < end and flat[position] in eliminated:
+                        position += 1
+                    pointers[ballot] = position
+                    if position < end:
+                        top = flat[position]
+                        count[top] += 1 if weights is None else weights[ballot]
+                        buckets[top].append(ballot)
+
+    possible_winners = list(count.keys())
+    trace.append((dict(count), possible_winners))
+    _count("stv_rounds", len(trace))
+    _count("ballots_touched", len(pointers) + moved)
+    return possible_winners, trace
+
+
+def STV(preferences, tie_break, return_trace=False, output="winner", k=None):
+ 
+    """
+    The voting rule works in rounds. In each round, the alternatives that appear
+    the least frequently in the first position of agents' rankings are removed, and the process is repeated. When the final set of alternatives
+    is removed (one or possibly more), then this last set is the set of possible winners.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    tie_break:
+        an option for the tie-breaking among possible winners.
+        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
+            max: Among the possible winning alternatives, select the one with the highest number.
+            min: Among the possible winning alternatives, select the one with the lowest number.
+            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+        A list of these options, such as [3, 7, "min"], is a chain that is applied in order (see TieBreaker).
+
+    return_trace: (bool)
+        if True, the elimination trace of stv_elimination is returned alongside the winner.
+
+    output: (str)
+        what to return: winner (the default), scores (the elimination trace, see stv_elimination), ranking (the social ordering as a list of tiers,
+        the possible winners first, then the alternatives removed in every round from the last round to the first) or top (the k best alternatives
+        of that ordering, ties broken with the tie-breaking option).
+
+    k: (int)
+        the number of alternatives returned when output is top.
+
+    RETURNS
+    -----------
+    it returns the winner of the Single Transferable Vote rule, using the tie-breaking option to distinguish between possible winners.
+    If output is scores, ranking or top, it returns the elimination trace, the social ordering or the list of the k best alternatives instead.
+    If return_trace is True, it returns a tuple (winner, trace).
+    The preference profile is not changed.
+
+    EXAMPLE
+    -----------
+    Alternative 3 is eliminated first, and the one ballot it tops moves to alternative 2, which ties with alternative 1 on three first places
+    (before stv_elimination, the rounds also gave alternative 1 a first place for the 3 found lower on its ballots, and elected it):
+
+    >>> preferences = {1: [1, 2, 3], 2: [3, 2, 1], 3: [1, 2, 3], 4: [2, 1, 3], 5: [1, 2, 3], 6: [2, 1, 3]}
+    >>> STV(preferences, "max")
+    2
+    >>> preferences[2]
+    [3, 2, 1]
+    """
+
+    _check_output(output, k)
+    possible_winners, trace = stv_elimination(preferences)  # the profile is left untouched
+    if output == "winner":
+        result = _break_tie(possible_winners, preferences, tie_break)
+    elif output == "scores":
+        result = trace
+    else:  # the elimination order of the single run, read backwards, is the social ordering
+        tiers = [sorted(removed) for counts, removed in reversed(trace)]
+        result = tiers if output == "ranking" else _break_tiers(tiers, preferences, tie_break, k)
+    if return_trace:
+        return result, trace
+    return result
+
+
+def pairwise_counts(preferences, chunk_size=100000):
+
+    """
+    Builds the m x m weighted majority matrix, where counts[a - 1][b - 1] is the number of agents that prefer alternative a to alternative b.
+    The agents are processed chunk by chunk: for every chunk, the positions of the alternatives (the inverse-rank arrays) are compared
+    column against column, once for every pair of alternatives, so the memory used is bounded by the chunk size.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+        A worksheet corresponding to an xlsx file, or the path to an xlsx or csv file, is read as a stream of valuations.
+
+    chunk_size: (int)
+        the number of agents processed at a time.
+
+    RETURNS
+    -----------
+    a list of m lists with the number of agents that prefer every alternative to every other alternative.
+    """
+
+    if not isinstance(preferences, Mapping):  # valuations, read chunk by chunk without building the profile
+        counts = None
+        for chunk in read_valuations(preferences, chunk_size):
+            rankings, positions = rank_valuation_matrix(chunk, positions=True)
+            chunk_counts = _flat_pairwise_counts(rankings, len(chunk[0]), positions=positions)
+            counts = chunk_counts if counts is None else _add_matrices(counts, chunk_counts)
+        return counts
+
+    weights = None
+    if isinstance(preferences, CompressedProfile):  # every distinct ballot is compared once, weighted by the number of agents that submitted it
+        weights = preferences.counts
+        preferences = preferences.ballots
+    if not isinstance(preferences, PreferenceProfile):
+        preferences = PreferenceProfile.from_dict(preferences)
+
+    n_alternatives = preferences.n_alternatives
+    counts = [[0] * n_alternatives for alternative in range(n_alternatives)]
+    with _phase("pairwise"):
+        for first in range(0, preferences.n_agents, chunk_size):
+            last = min(first + chunk_size, preferences.n_agents)
+            if preferences._positions is not None:
+                positions = preferences._positions[first * n_alternatives:last * n_alternatives]
+            else:  # the positions of this chunk only, so the inverse-rank arrays of the whole profile are never held in memory
+                positions = _flat_positions(preferences.rankings[first * n_alternatives:last * n_alternatives], n_alternatives)
+            _add_pairwise(counts, positions, n_alternatives, None if weights is None else weights[first:last])
+    _count("ballots_touched", preferences.n_agents)
+    return counts
+
+
+def _flat_pairwise_counts(rankings, n_alternatives, weights=None, positions=None):
+
+    """
+    Builds the weighted majority matrix of an array holding the rankings one after the other.
+    The inverse-rank arrays are built here, unless they are given (see rank_valuation_matrix).
+    """
+
+    if positions is None:
+        positions = _flat_positions(rankings, n_alternatives)
+    counts = [[0] * n_alternatives for alternative in range(n_alternatives)]
+    _add_pairwise(counts, positions, n_alternatives, weights)
+    return counts
+
+
+def _flat_positions(rankings, n_alternatives):
+
+    """
+    Builds the inverse-rank arrays of an array holding the rankings one after the other: the position of every alternative (0 for the most preferred).
+    """
+
+    positions = array(_smallest_typecode(n_alternatives), bytes(len(rankings) * array(_smallest_typecode(n_alternatives)).itemsize))
+    for start in range(0, len(rankings), n_alternatives):
+        ranking = rankings[start:start + n_alternatives]
+        positions[start:start + n_alternatives] = array(positions.typecode, sorted(range(n_alternatives), key=ranking.__getitem__))
+    return positions
+
+
+def _add_pairwise(counts, positions, n_alternatives, weights=None):
+
+    """
+    Adds to the majority matrix the agents whose inverse-rank arrays are stored one after the other in positions.
+    For every pair of alternatives, the two columns of positions are compared in a single pass.
+    """
+
+    columns = [positions[alternative::n_alternatives] for alternative in range(n_alternatives)]
+    total = len(columns[0]) if weights is None else sum(weights)
+    for first in range(n_alternatives):
+        for second in range(first + 1, n_alternatives):
+            preferred = map(lt, columns[first], columns[second])  # True for the agents that rank first above second
+            first_wins = sum(preferred) if weights is None else sum(keep_selected(weights, preferred))
+            counts[first][second] += first_wins
+            counts[second][first] += total - first_wins  # every agent ranks the two alternatives differently
+
+
+def _majority_margins(counts):
+
+    """
+    Returns, for every alternative, the number of alternatives it beats and the number of alternatives it loses to by a majority.
+    """
+
+    n_alternatives = len(counts)
+    wins = [sum(counts[first][second] > counts[second][first] for second in range(n_alternatives)) for first in range(n_alternatives)]
+    losses = [sum(counts[first][second] < counts[second][first] for second in range(n_alternatives)) for first in range(n_alternatives)]
+    return wins, losses
+
+
+def condorcet_scores(counts):
+
+    """
+    Returns the number of alternatives that beat each alternative by a majority. The Condorcet winner is the alternative with no such loss
+    that beats all the others, and the weak Condorcet winners are the alternatives that no alternative beats.
+    """
+
+    wins, losses = _majority_margins(counts)
+    return {alternative: losses[alternative - 1] for alternative in range(1, len(counts) + 1)}
+
+
+def copeland_scores(counts):
+
+    """
+    Returns the Copeland score of every alternative: the number of alternatives it beats by a majority minus the number it loses to.
+    This orders the alternatives like wins plus half of the pairwise ties.
+    """
+
+    wins, losses = _majority_margins(counts)
+    return {alternative: wins[alternative - 1] - losses[alternative - 1] for alternative in range(1, len(counts) + 1)}
+
+
+def maximin_scores(counts):
+
+    """
+    Returns the Maximin score of every alternative: the smallest number of agents that prefer it to another alternative.
+    """
+
+    n_alternatives = len(counts)
+    return {alternative: min((counts[alternative - 1][other] for other in range(n_alternatives) if other != alternative - 1), default=0)
+            for alternative in range(1, n_alternatives + 1)}
+
+
+def _pairwise_possible_winners(rule, counts):
+
+    """
+    Returns the scores of a pairwise rule and its possible winners: the alternatives with no majority loss for condorcet,
+    and the alternatives with the highest score for copeland and maximin.
+    """
+
+    scores = PAIRWISE_RULES[rule](counts)
+    best_score = 0 if rule == "condorcet" else max(scores.values())
+    return scores, [alternative for alternative, score in scores.items() if score == best_score]
+
+
+def condorcet(preferences, tie_break, output="winner", k=None):
+
+    """
+    The winner is the Condorcet winner, the alternative that a majority of agents prefers to every other alternative.
+    If there is no Condorcet winner, the possible winners are the weak Condorcet winners, the alternatives that no other alternative beats by a majority.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    tie_break:
+        an option for the tie-breaking among possible winners.
+        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
+            max: Among the possible winning alternatives, select the one with the highest number.
+            min: Among the possible winning alternatives, select the one with the lowest number.
+            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+        A list of these options, such as [3, 7, "min"], is a chain that is applied in order (see TieBreaker).
+
+    output: (str)
+        what to return: winner (the default), scores (the number of majority losses of every alternative, the fewer the better), ranking (the social ordering as a list of tiers,
+        the best first, every tier holding the alternatives with the same score) or top (the k best alternatives, ties broken with the tie-breaking option).
+
+    k: (int)
+        the number of alternatives returned when output is top.
+
+    RETURNS
+    -----------
+    it returns the Condorcet winner, or a weak Condorcet winner using the tie-breaking option to distinguish between them.
+    If every alternative is beaten by another one, it returns None.
+    If output is scores, ranking or top, it returns the scores, the social ordering or the list of the k best alternatives instead.
+    These always order the alternatives by their number of majority losses, so when the winner is None they still list alternatives,
+    the first of which is then not a winner: unlike the other rules, the first entry of top is the winner only when there is one.
+    """
+
+    _check_output(output, k)
+    losses, possible_winners = _pairwise_possible_winners("condorcet", pairwise_counts(preferences))
+    if output != "winner":  # the fewer majority losses, the better
+        return _rule_output(losses, preferences, tie_break, output, k, lowest_first=True)
+    if not possible_winners:
+        return None
+    return _break_tie(possible_winners, preferences, tie_break)
+
+
+def copeland(preferences, tie_break, output="winner", k=None):
+
+    """
+    Every alternative scores one point for every alternative it beats by a majority and loses one point for every alternative that beats it.
+    The winner is the alternative with the highest score.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    tie_break:
+        an option for the tie-breaking among possible winners.
+        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
+            max: Among the possible winning alternatives, select the one with the highest number.
+            min: Among the possible winning alternatives, select the one with the lowest number.
+            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+        A list of these options, such as [3, 7, "min"], is a chain that is applied in order (see TieBreaker).
+
+    output: (str)
+        what to return: winner (the default), scores (the total score of every alternative), ranking (the social ordering as a list of tiers,
+        the best first, every tier holding the alternatives with the same score) or top (the k best alternatives, ties broken with the tie-breaking option).
+
+    k: (int)
+        the number of alternatives returned when output is top.
+
+    RETURNS
+    -----------
+    it returns the winner of the Copeland rule, using the tie-breaking option to distinguish between possible winners.
+    If output is scores, ranking or top, it returns the scores, the social ordering or the list of the k best alternatives instead.
+    """
+
+    _check_output(output, k)
+    scores, possible_winners = _pairwise_possible_winners("copeland", pairwise_counts(preferences))
+    if output != "winner":
+        return _rule_output(scores, preferences, tie_break, output, k)
+    return _break_tie(possible_winners, preferences, tie_break)
+
+
+def maximin(preferences, tie_break, output="winner", k=None):
+
+    """
+    Every alternative scores the smallest number of agents that prefer it to another alternative, i.e., its worst pairwise comparison.
+    The winner is the alternative with the highest score.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    tie_break:
+        an option for the tie-breaking among possible winners.
+        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
+            max: Among the possible winning alternatives, select the one with the highest number.
+            min: Among the possible winning alternatives, select the one with the lowest number.
+            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+        A list of these options, such as [3, 7, "min"], is a chain that is applied in order (see TieBreaker).
+
+    output: (str)
+        what to return: winner (the default), scores (the total score of every alternative), ranking (the social ordering as a list of tiers,
+        the best first, every tier holding the alternatives with the same score) or top (the k best alternatives, ties broken with the tie-breaking option).
+
+    k: (int)
+        the number of alternatives returned when output is top.
+
+    RETURNS
+    -----------
+    it returns the winner of the Maximin rule, using the tie-breaking option to distinguish between possible winners.
+    If output is scores, ranking or top, it returns the scores, the social ordering or the list of the k best alternatives instead.
+    """
+
+    _check_output(output, k)
+    scores, possible_winners = _pairwise_possible_winners("maximin", pairwise_counts(preferences))
+    if output != "winner":
+        return _rule_output(scores, preferences, tie_break, output, k)
+    return _break_tie(possible_winners, preferences, tie_break)
+
+
+PAIRWISE_RULES = {"condorcet": condorcet_scores, "copeland": copeland_scores, "maximin": maximin_scores}  # the score of every rule built on the majority matrix
+
+
+def _valuation_sums(values, agents=()):
+
+    """
+    Reads the valuations chunk by chunk, and returns the sum of the valuations of every alternative
+    together with a dictionary holding the preference ordering of the given agents only (the agents that do not exist are left out).
+    """
+
+    valuation_sums = []
+    kept = {}
+    n_agents = 0
+    for chunk in read_valuations(values):
+        if not valuation_sums:
+            valuation_sums.extend([0] for alternative in chunk[0])
+        with _phase("sum"):
+            for alternative, column in enumerate(zip(*chunk)):  # adding the chunk to the running sums (see _add_to_sum)
+                valuation_sums[alternative] = _add_to_sum(valuation_sums[alternative], column)
+        for agent in agents:
+            if n_agents < agent <= n_agents + len(chunk):
+                kept[agent] = _rank_valuations(chunk[agent - n_agents - 1])
+        n_agents += len(chunk)
+    return list(map(_sum_value, valuation_sums)), kept
+
+
+def range_voting(values, tie_break, output="winner", k=None):
+
+    """
+    Sums the numerical values in an xlsx file, and chooses the alternative with the maximum sum as the winner.
+
+    PARAMETERS
+    -----------
+    values:
+        a worksheet corresponding to an xlsx file, or the path to an xlsx or csv file
+
+    tie_break:
+        an option for the tie-breaking among possible winners.
+        We will consider the following three tie-breaking rules. Here, we assume that the alternatives are represented by integers.
+            max: Among the possible winning alternatives, select the one with the highest number.
+            min: Among the possible winning alternatives, select the one with the lowest number.
+            agent : Among the possible winning alternatives, select the one that agent ranks the highest in his/her preference ordering. 
+        A list of these options, such as [3, 7, "min"], is a chain that is applied in order (see TieBreaker).
+
+    output: (str)
+        what to return: winner (the default), scores (the sum of the valuations of every alternative, correctly rounded with math.fsum when there are floats), ranking (the social ordering as a list of tiers,
+        the best first, every tier holding the alternatives with the same score) or top (the k best alternatives, ties broken with the tie-breaking option).
+
+    k: (int)
+        the number of alternatives returned when output is top.
+
+    RETURNS
+    -----------
+    The function should return the alternative that has the maximum sum of valuations, i.e.,
+    the maximum sum of numerical values in the xlsx file, using the tie-breaking option to distinguish between possible winners.
+    If output is scores, ranking or top, it returns the scores, the social ordering or the list of the k best alternatives instead.
+    """
+
+    _check_output(output, k)
+    tie_breaker = TieBreaker(None, tie_break.chain if isinstance(tie_break, TieBreaker) else tie_break)
+    valuation, tie_breaker.preferences = _valuation_sums(values, tie_breaker.agents())  # one pass gives the sums, and only the agents of the tie-breaking are ranked
+
+    if output != "winner":
+        return _rule_output(dict(enumerate(valuation, start=1)), tie_breaker.preferences, tie_breaker, output, k)
+    max_val = max(valuation)
+    possible_winners = [alternative + 1 for alternative in range(len(valuation)) if valuation[alternative] == max_val]  # creates a list of possible winners
+    return _break_tie(possible_winners, tie_breaker.preferences, tie_breaker)
+
+
+def _exact(value):
+
+    """
+    Returns the value as an exact number: integers and fractions are kept, and floats become the fraction they represent,
+    so that adding and then removing a ballot always gives back the same total.
+    """
+
+    return value if isinstance(value, (int, Fraction)) else Fraction(value)
+
+
+def _add_to_sum(parts, values):
+
+    """
+    Adds a column of valuations to a running sum kept as a list of parts whose exact sum is the total: an integer, then the floats
+    left by _float_expansion. Integers are added exactly, as sum does, and a column holding floats is folded into the floats,
+    so that _sum_value gives the math.fsum of all the valuations, whatever the chunks they were read in.
+    """
+
+    total = sum(values)
+    if isinstance(total, int):
+        return [parts[0] + total] + parts[1:]
+    return [parts[0]] + _float_expansion(chain(parts[1:], values))
+
+
+def _float_expansion(values):
+
+    """
+    Returns floats whose exact sum is the exact sum of the values: the correctly rounded sum (math.fsum), then what it left out, and so on.
+    """
+
+    values = list(values)
+    expansion = []
+    while True:
+        part = fsum(values)
+        if part == 0 or not isfinite(part):
+            return expansion + [part] if not expansion or part else expansion
+        expansion.append(part)
+        values.append(-part)
+
+
+def _sum_value(parts):
+    return parts[0] if len(parts) == 1 else fsum(parts)  # the integer sum, or the correctly rounded sum of the valuations with floats
+
+
+def _merge_sums(first, second):
+    if len(first) == 1 and len(second) == 1:
+        return [first[0] + second[0]]
+    return [first[0] + second[0]] + _float_expansion(first[1:] + second[1:])
+
+
+class _IncrementalTally:
+
+    """
+    The part shared by the incremental tallies: the running total of every alternative and the preference ordering of every agent,
+    which is kept for the agent tie-breaking and for removing the ballot of an agent later on.
+    """
+
+    def __init__(self, n_alternatives):
+        self.n_alternatives = n_alternatives
+        self.totals = dict.fromkeys(range(1, n_alternatives + 1), 0)
+        self.preferences = {}  # the preference ordering of every agent, in the format returned by generate_preferences
+
+    def __len__(self):
+        return len(self.preferences)
+
+    def remove_ballot(self, agent):
+
+        """
+        Removes the ballot of the agent in O(m) time.
+        """
+
+        if agent not in self.preferences:
+            raise KeyError(f"agent {agent} has no ballot")
+        self._apply(agent, -1)
+        del self.preferences[agent]
+
+    def current_winner(self, tie_break):
+
+        """
+        Returns the alternative with the highest total in O(m) time, using the tie-breaking option (max, min or an agent)
+        to distinguish between alternatives with the same total.
+        """
+
+        totals = self._compared_totals()
+        highest_total = max(totals.values())
+        possible_winners = [alternative for alternative, total in totals.items() if total == highest_total]
+        return _break_tie(possible_winners, self.preferences, tie_break)
+
+    def _compared_totals(self):
+        return self.totals
+
+
+class PositionalTally(_IncrementalTally):
+
+    """
+    A running tally of a positional scoring rule that is updated one ballot at a time, so a result can be kept up to date
+    without rescanning the profile. Adding, removing or replacing a ballot and asking for the current winner each take O(m) time,
+    and the winner is the one positional_winner returns for the same ballots.
+
+    PARAMETERS
+    -----------
+    score_vector: (list)
+        the score given to the alternative at each position, the first score going to the most preferred alternative.
+        Float scores are kept as exact fractions, so totals never drift as ballots come and go; the winner is then found from
+        the position count matrix, adding the float scores in the same order as positional_winner, which takes O(m^2) time.
+
+    EXAMPLE
+    -----------
+    >>> preferences = {1: [1, 2, 4, 3], 2: [3, 4, 2, 1], 3: [2, 4, 3, 1], 4: [2, 3, 1, 4], 5: [4, 2, 1, 3], 6: [3, 4, 2, 1],
+    ...                7: [3, 4, 2, 1], 8: [3, 2, 4, 1], 9: [3, 2, 4, 1]}
+    >>> tally = PositionalTally([1.1, 1.1, 0.2, 0.2])
+    >>> for agent, ranking in preferences.items():
+    ...     tally.add_ballot(agent, ranking)
+    >>> tally.current_winner("max"), scoring_rule(preferences, [1.1, 1.1, 0.2, 0.2], "max")
+    (2, 2)
+    """
+
+    def __init__(self, score_vector):
+        super().__init__(len(score_vector))
+        self.score_vector = [_exact(score) for score in score_vector]
+        self.counts = [[0] * len(score_vector) for position in score_vector]  # counts[position][alternative - 1], as returned by position_counts
+        self.float_scores = list(score_vector) if any(isinstance(score, float) for score in score_vector) else None
+
+    @classmethod
+    def for_rule(cls, rule, n_alternatives):
+
+        """
+        Returns an empty tally for plurality, veto, borda or harmonic with m alternatives.
+        """
+
+        return cls(rule_score_vector(rule, n_alternatives))
+
+    @classmethod
+    def from_profile(cls, preferences, score_vector):
+
+        """
+        Returns a tally that already holds every ballot of a preference profile, using one scan of the profile.
+        """
+
+        tally = cls(score_vector)
+        tally.counts = position_counts(preferences)
+        tally.totals = positional_scores(tally.counts, tally.score_vector)
+        tally.preferences = {agent: list(pref_list) for agent, pref_list in preferences.items()}
+        return tally
+
+    def add_ballot(self, agent, ranking):
+
+        """
+        Adds the preference ordering of a new agent in O(m) time.
+        """
+
+        if agent in self.preferences:
+            raise ValueError(f"agent {agent} already has a ballot")
+        if sorted(ranking) != list(self.totals):
+            raise ValueError(f"preference ordering of agent {agent} is not a ranking of the alternatives 1 to {self.n_alternatives}")
+        self.preferences[agent] = list(ranking)
+        self._apply(agent, 1)
+
+    def replace_ballot(self, agent, ranking):
+
+        """
+        Replaces the preference ordering of an agent in O(m) time.
+        """
+
+        self.remove_ballot(agent)
+        self.add_ballot(agent, ranking)
+
+    def _apply(self, agent, sign):
+        for position, (alternative, score) in enumerate(zip(self.preferences[agent], self.score_vector)):
+            self.totals[alternative] += sign * score
+            self.counts[position][alternative - 1] += sign
+
+    def _compared_totals(self):
+        if self.float_scores is None:
+            return self.totals
+        return _counted_scores(self.counts, len(self.preferences), self.float_scores)  # the float sums of positional_winner
+
+
+class RangeTally(_IncrementalTally):
+
+    """
+    A running tally of range voting that is updated one ballot at a time. Adding, removing or replacing the valuations of an agent
+    and asking for the current winner each take O(m) time, and the winner is the one range_voting returns for the same valuations.
+    The totals are kept exactly, and a total with floats is rounded once when it is compared, which gives the math.fsum of range_voting.
+
+    PARAMETERS
+    -----------
+    n_alternatives: (int)
+        the number of alternatives m.
+
+    EXAMPLE
+    -----------
+    Both alternatives sum to 0.4, so min breaks the tie:
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "valuations.csv")
+    >>> with open(path, "w") as csv_file:
+    ...     _ = csv_file.write("0.1,0.2\\n0.3,0.2\\n")
+    >>> tally = RangeTally(2)
+    >>> tally.add_ballot(1, [0.1, 0.2])
+    >>> tally.add_ballot(2, [0.3, 0.2])
+    >>> tally.current_winner("min"), range_voting(path, "min")
+    (1, 1)
+    """
+
+    def __init__(self, n_alternatives):
+        super().__init__(n_alternatives)
+        self.valuations = {}  # the valuations of every agent, kept to be able to remove them later on
+        self.n_floats = dict.fromkeys(range(1, n_alternatives + 1), 0)  # the number of float valuations of every alternative
+
+    def add_ballot(self, agent, valuations):
+
+        """
+        Adds the valuations of a new agent for the alternatives 1 to m in O(m) time.
+        """
+
+        if agent in self.preferences:
+            raise ValueError(f"agent {agent} already has a ballot")
+        if len(valuations) != self.n_alternatives:
+            raise ValueError(f"the valuations of agent {agent} do not have length {self.n_alternatives}")
+        self.valuations[agent] = list(valuations)
+        self.preferences[agent] = _rank_valuations(valuations)  # the preference ordering is only needed for the agent tie-breaking
+        self._apply(agent, 1)
+
+    def remove_ballot(self, agent):
+        super().remove_ballot(agent)
+        del self.valuations[agent]
+
+    def replace_ballot(self, agent, valuations):
+
+        """
+        Replaces the valuations of an agent in O(m) time.
+        """
+
+        self.remove_ballot(agent)
+        self.add_ballot(agent, valuations)
+
+    def _apply(self, agent, sign):
+        for alternative, value in enumerate(self.valuations[agent], start=1):
+            self.totals[alternative] += sign * _exact(value)
+            self.n_floats[alternative] += sign * isinstance(value, float)
+
+    def _compared_totals(self):
+        # the exact total of a column with floats, rounded once, is the math.fsum that range_voting gives
+        return {alternative: float(total) if self.n_floats[alternative] else total for alternative, total in self.totals.items()}
+
+
+class ShardTally:
+
+    """
+    The tally of one shard of agents, small enough to be sent back from a worker process instead of the ballots themselves.
+    Tallies of different shards are merged by adding them together.
+
+    PARAMETERS
+    -----------
+    n_agents: (int)
+        the number of agents in the shard.
+
+    counts: (list)
+        the position count matrix of the shard, as returned by position_counts.
+
+    valuation_sums: (list)
+        the running sum of the valuations of every alternative as kept by _add_to_sum, or None when the shard holds rankings only.
+
+    pairwise: (list)
+        the m x m matrix where pairwise[a - 1][b - 1] is the number of agents that prefer a to b, or None when it was not asked for.
+    """
+
+    def __init__(self, n_agents, counts, valuation_sums=None, pairwise=None):
+        self.n_agents = n_agents
+        self.counts = counts
+        self.valuation_sums = valuation_sums
+        self.pairwise = pairwise
+
+    def __add__(self, other):
+        return ShardTally(self.n_agents + other.n_agents, _add_matrices(self.counts, other.counts),
+                          None if self.valuation_sums is None else list(map(_merge_sums, self.valuation_sums, other.valuation_sums)),
+                          None if self.pairwise is None else _add_matrices(self.pairwise, other.pairwise))
+
+    def __repr__(self):
+        return f"ShardTally(n_agents={self.n_agents}, n_alternatives={len(self.counts)})"
+
+
+def _add_matrices(first, second):
+    return [list(map(sum, zip(first_row, second_row))) for first_row, second_row in zip(first, second)]
+
+
+def _tally_shard(shard, pairwise):
+
+    """
+    Tallies one shard in a worker process. A shard is one of
+        ("mapped", path, first, last): the rankings first to last (excluded) of a file written by save_profile,
+        ("rankings", typecode, m, data, weights): the rankings as the bytes of an array, with the weight of every ranking or None,
+        ("valuations", rows): the valuations of the agents,
+        ("csv", path, start, end): the rows of a csv file that start between the two byte offsets.
+    """
+
+    kind = shard[0]
+    valuation_sums = None
+    weights = None
+    positions = None  # built along with the rankings of valuations, and from the rankings otherwise
+    if kind == "mapped":  # the worker maps the same file, so the rankings are shared instead of sent
+        path, first, last = shard[1:]
+        profile = load_profile(path)
+        if isinstance(profile, CompressedProfile):
+            weights = profile.counts[first:last]
+            profile = profile.ballots
+        n_alternatives = profile.n_alternatives
+        rankings = profile.rankings[first * n_alternatives:last * n_alternatives]
+    elif kind == "rankings":
+        typecode, n_alternatives, data, weights = shard[1:]
+        rankings = array(typecode)
+        rankings.frombytes(data)
+    else:
+        rows = shard[1] if kind == "valuations" else list(_csv_byte_range(*shard[1:]))
+        if not rows:  # a byte range of a csv file can hold no row at all
+            return None
+        n_alternatives = len(rows[0])
+        valuation_sums = [_add_to_sum([0], column) for column in zip(*rows)]
+        if pairwise:  # the inverse-rank arrays come with the rankings
+            rankings, positions = rank_valuation_matrix(rows, positions=True)
+        else:
+            rankings = rank_valuation_matrix(rows)
+
+    n_agents = len(rankings) // n_alternatives if weights is None else sum(weights)
+    return ShardTally(n_agents, _flat_position_counts(rankings, n_alternatives, weights), valuation_sums,
+                      _flat_pairwise_counts(rankings, n_alternatives, weights, positions) if pairwise else None)
+
+
+def _csv_byte_range(path, start, end):
+
+    """
+    Yields the parsed rows of a csv file whose first byte lies between the offsets start (included) and end (excluded).
+    """
+
+    with open(path, "rb") as csv_file:
+        if start > 0:  # skipping the end of the row that started in the previous range
+            csv_file.seek(start - 1)
+            csv_file.readline()
+        position = csv_file.tell()
+        while position < end:
+            line = csv_file.readline()
+            if not line:
+                break
+            position += len(line)
+            for row in csv.reader([line.decode()]):
+                if row:  # skipping blank lines
+                    yield [_parse_value(cell) for cell in row]
+
+
+def _csv_row(path, start, end, index):
+
+    """
+    Returns the row with the given index (0 for the first one) among the rows of a csv file that start between the two byte offsets.
+    """
+
+    return next(islice(_csv_byte_range(path, start, end), index, None))
+
+
+class _LazyBallots(Mapping):
+
+    """
+    The agents of a sharded profile, where the preference ordering of an agent is only fetched, from its shard, when it is asked for.
+    This is all the tie-breaking needs, so the profile never has to be sent to or gathered from the workers.
+    """
+
+    def __init__(self, n_agents, fetch):
+        self.n_agents = n_agents
+        self.fetch = fetch
+        self.fetched = {}
+
+    def __getitem__(self, agent):
+        if not isinstance(agent, int) or not 1 <= agent <= self.n_agents:
+            raise KeyError(agent)
+        if agent not in self.fetched:
+            self.fetched[agent] = self.fetch(agent)
+        return self.fetched[agent]
+
+    def __iter__(self):
+        return iter(range(1, self.n_agents + 1))
+
+    def __len__(self):
+        return self.n_agents
+
+
+def _profile_shards(preferences, chunk_size):
+
+    """
+    Splits an in-memory profile into shards of at most chunk_size rankings, sent to the workers as the bytes of an array.
+    A memory-mapped profile is only sent as the range of rankings, and every worker maps the file itself.
+    """
+
+    if getattr(preferences, "path", None) is not None:
+        n_rankings = preferences.n_ballots if isinstance(preferences, CompressedProfile) else preferences.n_agents
+        for first in range(0, n_rankings, chunk_size):
+            yield ("mapped", preferences.path, first, min(first + chunk_size, n_rankings))
+        return
+
+    if isinstance(preferences, CompressedProfile):
+        ballots = preferences.ballots
+        for first in range(0, preferences.n_ballots, chunk_size):
+            last = min(first + chunk_size, preferences.n_ballots)
+            yield ("rankings", ballots.typecode, ballots.n_alternatives,
+                   ballots.rankings[first * ballots.n_alternatives:last * ballots.n_alternatives].tobytes(), preferences.counts[first:last].tolist())
+        return
+
+    if not isinstance(preferences, PreferenceProfile):
+        preferences = PreferenceProfile.from_dict(preferences)
+    size = chunk_size * preferences.n_alternatives
+    for start in range(0, len(preferences.rankings), size):
+        yield ("rankings", preferences.typecode, preferences.n_alternatives, preferences.rankings[start:start + size].tobytes(), None)
+
+
+def parallel_tally(values, workers=None, chunk_size=10000, pairwise=False, tie_break=None):
+
+    """
+    Splits the agents into shards and tallies every shard in a pool of worker processes.
+    The workers only send back the small tally of their shard (see ShardTally), never the ballots, and the tallies are merged here.
+
+    PARAMETERS
+    -----------
+    values:
+        a preference profile (dict, PreferenceProfile or CompressedProfile), a worksheet corresponding to an xlsx file,
+        or the path to an xlsx or csv file. A csv file is split into byte ranges that the workers read on their own,
+        while the rows of a worksheet or xlsx file are read here and sent to the workers chunk by chunk.
+
+    workers: (int)
+        the number of worker processes, by default the number of cores.
+
+    chunk_size: (int)
+        the number of agents in a shard of a profile, worksheet or xlsx file.
+
+    pairwise: (bool)
+        if True, the pairwise preference counts are tallied as well.
+
+    tie_break:
+        the tie-breaking option that will be used. The preference orderings of its agents are kept while the rows are read.
+
+    RETURNS
+    -----------
+    a tuple (tally, preferences), where tally is the merged ShardTally and preferences maps every agent to its preference ordering.
+    Apart from the tie-breaking agent, the preference ordering of an agent is only read again, from its own shard, when it is asked for.
+    """
+
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor  # only needed for the parallel mode
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+
+        if isinstance(values, Mapping):  # the profile is already in memory, so the tie-breaking agent is simply looked up here
+            tallies = list(pool.map(_tally_shard, _profile_shards(values, chunk_size), repeat(pairwise)))
+            return sum(tallies[1:], tallies[0]), values
+
+        if isinstance(values, (str, os.PathLike)) and os.fspath(values).lower().endswith(".csv"):
+            size = os.path.getsize(values)
+            n_shards = 4 * workers
+            ranges = [(values, size * shard // n_shards, size * (shard + 1) // n_shards) for shard in range(n_shards)]
+            tallies = list(pool.map(_tally_shard, [("csv",) + byte_range for byte_range in ranges], [pairwise] * n_shards))
+            shards = [(byte_range, tally) for byte_range, tally in zip(ranges, tallies) if tally is not None]
+            ends = list(accumulate(tally.n_agents for byte_range, tally in shards))
+
+            def fetch(agent):  # only the byte range holding the agent is read again
+                shard = bisect_right(ends, agent - 1)
+                return _rank_valuations(_csv_row(*shards[shard][0], agent - 1 - (ends[shard - 1] if shard else 0)))
+
+            tally = sum((tally for byte_range, tally in shards[1:]), shards[0][1])
+            return tally, _LazyBallots(tally.n_agents, fetch)
+
+        tie_agents = [] if tie_break is None else TieBreaker(None, tie_break).agents()
+        kept = {}
+        pending = deque()  # at most two chunks per worker are waiting, so the memory stays bounded by the chunk size
+        tallies = []
+        for shard, chunk in enumerate(read_valuations(values, chunk_size)):
+            for tie_agent in tie_agents:
+                if shard * chunk_size < tie_agent <= shard * chunk_size + len(chunk):
+                    kept[tie_agent] = _rank_valuations(chunk[tie_agent - 1 - shard * chunk_size])
+            pending.append(pool.submit(_tally_shard, ("valuations", chunk), pairwise))
+            if len(pending) > 2 * workers:
+                tallies.append(pending.popleft().result())
+        tallies.extend(future.result() for future in pending)
+
+        def fetch(agent):  # reading the valuations again up to the chunk holding the agent
+            chunk = next(islice(read_valuations(values, chunk_size), (agent - 1) // chunk_size, None))
+            return _rank_valuations(chunk[(agent - 1) % chunk_size])
+
+        tally = sum(tallies[1:], tallies[0])
+        preferences = _LazyBallots(tally.n_agents, fetch)
+        preferences.fetched.update(kept)
+        return tally, preferences
+
+
+def parallel_evaluate(values, rules, tie_break, workers=None, chunk_size=10000):
+
+    """
+    Evaluates several rules with parallel_tally: the shards are tallied in worker processes and every winner is found from the merged tally.
+
+    PARAMETERS
+    -----------
+    values:
+        a preference profile (dict, PreferenceProfile or CompressedProfile), a worksheet corresponding to an xlsx file,
+        or the path to an xlsx or csv file.
+
+    rules: (list)
+        the rules to evaluate: plurality, veto, borda, harmonic, condorcet, copeland and maximin by name,
+        custom scoring rules by their score vector, and range_voting when the values are valuations. STV works in rounds over the whole profile, so it cannot be sharded.
+
+    tie_break:
+        an option for the tie-breaking among possible winners (max, min or an agent), used for every rule.
+
+    workers: (int)
+        the number of worker processes, by default the number of cores.
+
+    chunk_size: (int)
+        the number of agents in a shard of a profile, worksheet or xlsx file.
+
+    RETURNS
+    -----------
+    a dictionary where the keys are the rules (a score vector becomes a tuple) and the values are tuples (winner, scores),
+    scores being a dictionary with the total score (or the sum of valuations) of every alternative.
+    """
+
+    if "STV" in rules:
+        raise ValueError("STV cannot be evaluated in parallel shards")
+
+    pairwise = any(rule in PAIRWISE_RULES for rule in rules if isinstance(rule, str))
+    chain = tie_break.chain if isinstance(tie_break, TieBreaker) else tie_break
+    tally, preferences = parallel_tally(values, workers, chunk_size, pairwise, chain)
+    tie_break = TieBreaker(preferences, chain)  # shared by all the rules
+    n_alternatives = len(tally.counts)
+
+    results = {}
+    for rule in rules:
+        if isinstance(rule, str) and rule in PAIRWISE_RULES:
+            scores, possible_winners = _pairwise_possible_winners(rule, tally.pairwise)
+            results[rule] = (_break_tie(possible_winners, preferences, tie_break) if possible_winners else None, scores)
+            continue
+        if rule == "range_voting":
+            if tally.valuation_sums is None:
+                raise ValueError("range_voting needs valuations, not a preference profile")
+            key = rule
+            scores = dict(enumerate(map(_sum_value, tally.valuation_sums), start=1))
+        elif isinstance(rule, str):
+            key = rule
+            scores = positional_scores(tally.counts, rule_score_vector(rule, n_alternatives))
+        elif len(rule) != n_alternatives:
+            raise ValueError(f"score vector {list(rule)} does not have length {n_alternatives}")
+        else:
+            key = tuple(rule)
+            scores = positional_scores(tally.counts, sorted(rule, reverse=True))
+        highest_score = max(scores.values())
+        possible_winners = [alternative for alternative, score in scores.items() if score == highest_score]
+        results[key] = (_break_tie(possible_winners, preferences, tie_break), scores)
+    return results
+
+
+def impartial_culture_profile(n_agents, n_alternatives, seed=None):
+
+    """
+    Returns a PreferenceProfile where every agent draws a ranking uniformly at random (the impartial culture).
+    The same seed always gives the same profile.
+    """
+
+    rng = random.Random(seed)
+    alternatives = list(range(1, n_alternatives + 1))
+    return PreferenceProfile.from_rankings(rng.sample(alternatives, n_alternatives) for agent in range(n_agents))
+
+
+def mallows_profile(n_agents, n_alternatives, phi, seed=None):
+
+    """
+    Returns a PreferenceProfile drawn from the Mallows model around the ranking 1, 2, ..., m with dispersion phi,
+    using the repeated insertion method. phi = 0 gives the same ranking to every agent and phi = 1 is the impartial culture.
+    """
+
+    rng = random.Random(seed)
+    weights = [[phi ** (inserted - slot) for slot in range(inserted + 1)] for inserted in range(n_alternatives)]  # the weight of every slot for the alternative inserted in that step
+    slots = [list(range(inserted + 1)) for inserted in range(n_alternatives)]
+
+    def ranking():
+        current = []
+        for inserted in range(n_alternatives):
+            current.insert(rng.choices(slots[inserted], weights[inserted])[0], inserted + 1)
+        return current
+
+    return PreferenceProfile.from_rankings(ranking() for agent in range(n_agents))
+
+
+def single_peaked_profile(n_agents, n_alternatives, seed=None):
+
+    """
+    Returns a PreferenceProfile that is single-peaked on the axis 1, 2, ..., m, drawn uniformly among the single-peaked rankings:
+    the ranking is built from the least preferred alternative up, each time taking the leftmost or the rightmost remaining alternative.
+    """
+
+    rng = random.Random(seed)
+
+    def ranking():
+        left, right = 1, n_alternatives
+        worst_first = []
+        while left < right:
+            if rng.random() < 0.5:
+                worst_first.append(left)
+                left += 1
+            else:
+                worst_first.append(right)
+                right -= 1
+        worst_first.append(left)  # the peak
+        return worst_first[::-1]
+
+    return PreferenceProfile.from_rankings(ranking() for agent in range(n_agents))
+
+
+def duplicate_profile(n_agents, n_alternatives, n_distinct, seed=None):
+
+    """
+    Returns a PreferenceProfile where every agent picks one of only n_distinct random rankings, so the same rankings appear many times.
+    """
+
+    rng = random.Random(seed)
+    alternatives = list(range(1, n_alternatives + 1))
+    pool = [rng.sample(alternatives, n_alternatives) for ballot in range(n_distinct)]
+    return PreferenceProfile.from_rankings(rng.choice(pool) for agent in range(n_agents))
+
+
+def tied_profile(n_agents, n_alternatives, seed=None):
+
+    """
+    Returns a PreferenceProfile full of ties: the agents take turns with the m cyclic shifts of one random ranking,
+    so when n is a multiple of m every alternative appears equally often at every position and every rule has to break a tie.
+    """
+
+    rng = random.Random(seed)
+    base = rng.sample(range(1, n_alternatives + 1), n_alternatives)
+    shifts = [base[shift:] + base[:shift] for shift in range(n_alternatives)]
+    return PreferenceProfile.from_rankings(shifts[agent % n_alternatives] for agent in range(n_agents))
+
+
+def random_valuations(n_agents, n_alternatives, max_value=9, seed=None):
+
+    """
+    Returns the valuations of n agents for m alternatives as a list of rows of integers between 0 and max_value.
+    A small max_value gives many equal valuations, and so many ties in the rankings and in range voting.
+    """
+
+    rng = random.Random(seed)
+    return [[rng.randint(0, max_value) for alternative in range(n_alternatives)] for agent in range(n_agents)]
+
+
+def profile_fingerprint(preferences, chunk_size=1 << 20):
+
+    """
+    Returns a content hash of a preference profile, so that two profiles with the same rankings (and, for a CompressedProfile,
+    the same multiplicities and agents) have the same fingerprint. The arrays of a PreferenceProfile or CompressedProfile are hashed
+    chunk by chunk straight from their buffers, and the fingerprint is kept on the profile, which never changes, so it is only computed once.
+    A dictionary can change at any time, so its fingerprint is computed again on every call.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    chunk_size: (int)
+        the number of bytes hashed at a time.
+
+    RETURNS
+    -----------
+    a hexadecimal string.
+    """
+
+    fingerprint = getattr(preferences, "_fingerprint", None)
+    if fingerprint is not None:
+        return fingerprint
+
+    import hashlib  # only needed for the result cache
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(type(preferences).__name__.encode())
+    if isinstance(preferences, (PreferenceProfile, CompressedProfile)):
+        digest.update(struct.pack("<QQ", len(preferences), preferences.n_alternatives))
+        sections = [preferences.rankings] if isinstance(preferences, PreferenceProfile) else [preferences.ballots.rankings, preferences.counts, preferences.agent_ballot]
+        for section in sections:
+            if section is None:
+                continue
+            view = memoryview(section).cast("B")
+            digest.update(section.itemsize.to_bytes(1, "little"))
+            for start in range(0, len(view), chunk_size):
+                digest.update(view[start:start + chunk_size])
+        fingerprint = digest.hexdigest()
+        preferences._fingerprint = fingerprint
+        return fingerprint
+
+    items = iter(preferences.items())
+    while True:
+        chunk = list(islice(items, 10000))
+        if not chunk:
+            return digest.hexdigest()
+        digest.update(repr(chunk).encode())
+
+
+class ResultCache:
+
+    """
+    A cache of the results of the voting rules, keyed by the fingerprint of the profile (see profile_fingerprint), the rule,
+    its score vector and the tie-breaking option. Both the intermediate tallies (position counts, first-choice counts,
+    the majority matrix and STV elimination traces) and the final winners are kept, so evaluating the same profile with
+    another tie-breaking option reuses the cached tally and only breaks the tie again.
+    When more than max_entries results are cached, the least recently used ones are evicted.
+
+    PARAMETERS
+    -----------
+    max_entries: (int)
+        the largest number of cached results.
+    """
+
+    def __init__(self, max_entries=1024):
+
+        from collections import OrderedDict  # only needed for the result cache
+
+        if max_entries < 1:
+            raise ValueError("max_entries must be a positive integer")
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+
+        """
+        Returns a dictionary with the number of hits, misses, cached entries and the size bound.
+        """
+
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "max_entries": self.max_entries}
+
+    def _memo(self, key, compute):
+
+        """
+        Returns the cached result for the key, computing and caching it on a miss.
+        """
+
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)  # now the most recently used
+            return self.entries[key]
+        self.misses += 1
+        result = compute()
+        self.entries[key] = result
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)  # evicting the least recently used result
+        return result
+
+    def position_counts(self, preferences):
+        return self._memo((profile_fingerprint(preferences), "position_counts"), lambda: position_counts(preferences))
+
+    def first_choice_counts(self, preferences):
+        fingerprint = profile_fingerprint(preferences)
+        full_counts = self.entries.get((fingerprint, "position_counts"))
+        if full_counts is not None:  # the first row of a cached position count matrix
+            return full_counts[0]
+        return self._memo((fingerprint, "first_choice_counts"), lambda: position_counts(preferences, [0])[0])
+
+    def pairwise_counts(self, preferences):
+        return self._memo((profile_fingerprint(preferences), "pairwise_counts"), lambda: pairwise_counts(preferences))
+
+    def stv_elimination(self, preferences):
+        return self._memo((profile_fingerprint(preferences), "stv_elimination"), lambda: stv_elimination(preferences))
+
+    def outcome(self, preferences, rule):
+
+        """
+        Returns the scores and the possible winners of a rule, before any tie-breaking.
+
+        PARAMETERS
+        -----------
+        preferences: (dict, PreferenceProfile or CompressedProfile)
+            A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+        rule:
+            plurality, veto, borda, harmonic, STV, condorcet, copeland or maximin by name, or the score vector of a custom scoring rule.
+
+        RETURNS
+        -----------
+        a tuple (scores, possible_winners), scores being as in evaluate_all.
+        """
+
+        return self._memo((profile_fingerprint(preferences), "outcome", _rule_key(rule)), lambda: self._compute_outcome(preferences, rule))
+
+    def _compute_outcome(self, preferences, rule):
+        if rule == "STV":
+            possible_winners, trace = self.stv_elimination(preferences)
+            return trace, possible_winners
+        if isinstance(rule, str) and rule in PAIRWISE_RULES:
+            return _pairwise_possible_winners(rule, self.pairwise_counts(preferences))
+        if rule == "plurality":
+            scores = dict(enumerate(self.first_choice_counts(preferences), start=1))
         else:
-            try:
-                if int(tie_break) not in preferences.keys():
-                    raise ValueError("Alternative does not correspond to an agent")
-            except Exception as exp:
-                print(f"ERROR HAS OCCURED: {exp}")
-                return False
+            n_alternatives = len(preferences[1])
+            if isinstance(rule, str):
+                score_vector = rule_score_vector(rule, n_alternatives)
+            elif len(rule) != n_alternatives:
+                raise ValueError(f"score vector {list(rule)} does not have length {n_alternatives}")
             else:
-                pref = preferences[tie_break]
-                pref_index = []
-                for alternative in possible_winners:
-                    if alternative in pref:
-                        pref_index.append(pref.index(alternative))
-                return pref[min(pref_index)]
+                score_vector = sorted(rule, reverse=True)  # the highest score goes to the most preferred alternative
+            scores = positional_scores(self.position_counts(preferences), score_vector)
+        highest_score = max(scores.values())
+        return scores, [alternative for alternative, score in scores.items() if score == highest_score]
+
+    def evaluate(self, preferences, rule, tie_break):
+
+        """
+        Returns the winner of a rule, using the cached winner, or else the cached tally, whenever there is one.
+
+        PARAMETERS
+        -----------
+        preferences: (dict, PreferenceProfile or CompressedProfile)
+            A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+        rule:
+            plurality, veto, borda, harmonic, STV, condorcet, copeland or maximin by name, or the score vector of a custom scoring rule.
+
+        tie_break:
+            an option for the tie-breaking among possible winners (max, min, an agent or a chain of them, see TieBreaker).
+
+        RETURNS
+        -----------
+        it returns the winner of the rule, using the tie-breaking option to distinguish between possible winners.
+        """
+
+        chain = tie_break.chain if isinstance(tie_break, TieBreaker) else tie_break
+        key = (profile_fingerprint(preferences), "winner", _rule_key(rule), _tie_break_key(chain))
+
+        def compute():
+            scores, possible_winners = self.outcome(preferences, rule)
+            if not possible_winners:  # condorcet may have no winner
+                return None
+            return _break_tie(possible_winners, preferences, tie_break)
+
+        return self._memo(key, compute)
+
+
+def _rule_key(rule):
+    return rule if isinstance(rule, str) else ("scoring_rule",) + tuple(sorted(rule, reverse=True))
+
+
+def _tie_break_key(tie_break):
+    chain = tie_break if isinstance(tie_break, (list, tuple)) else [tie_break]
+    return tuple(option if option in ("min", "max") else str(option) for option in chain)
+
+
+def stack_elections(elections):
+
+    """
+    Stacks many elections with the same alternatives into the flat form taken by evaluate_batch.
+
+    PARAMETERS
+    -----------
+    elections: (list)
+        the elections, each one a preference profile (dict, PreferenceProfile or CompressedProfile) or a list of preference orderings.
+
+    RETURNS
+    -----------
+    a tuple (rankings, n_alternatives, offsets): the rankings of every agent of every election one after the other in one array,
+    the number of alternatives m, and the offsets, where the agents of election e are the agents offsets[e] to offsets[e + 1] (excluded).
+    """
+
+    rankings = None
+    offsets = [0]
+    for election in elections:
+        pref_lists = [election[agent] for agent in range(1, len(election) + 1)] if isinstance(election, Mapping) else election
+        if rankings is None:
+            n_alternatives = len(pref_lists[0])
+            rankings = array(_smallest_typecode(n_alternatives))
+        for pref_list in pref_lists:
+            if len(pref_list) != n_alternatives:
+                raise ValueError("all the elections must have the same number of alternatives")
+            rankings.extend(pref_list)
+        offsets.append(offsets[-1] + len(pref_lists))
+    if rankings is None:
+        raise ValueError("there must be at least one election")
+    return rankings, n_alternatives, offsets
+
+
+def evaluate_batch(rankings, n_alternatives, rule, tie_break, n_agents=None, offsets=None):
+
+    """
+    Finds the winners of many small elections at once. The elections are given as one flat stack of rankings (an E x n x m array,
+    or a ragged stack with offsets, see stack_elections). The positions of all elections are tallied together in one pass per position,
+    the scores of every alternative of every election are read off those tallies, and the min, max and agent tie-breaking options
+    are applied to all the elections in the same way, so the cost per election is a few operations rather than a whole call of a rule.
+
+    PARAMETERS
+    -----------
+    rankings: (array or list)
+        the preference orderings of all the agents of all the elections, one after the other, most preferred alternative first.
+
+    n_alternatives: (int)
+        the number of alternatives m, the same in every election.
+
+    rule:
+        plurality, veto, borda or harmonic by name, or the score vector of a custom scoring rule.
+
+    tie_break:
+        an option for the tie-breaking among possible winners (max, min, an agent or a chain of them, see TieBreaker).
+        An agent is numbered within its election, from 1.
+
+    n_agents: (int)
+        the number of agents n of every election, when they all have the same number of agents.
+
+    offsets: (list)
+        otherwise, the offsets of the elections: the agents of election e are the agents offsets[e] to offsets[e + 1] (excluded).
+
+    RETURNS
+    -----------
+    a list with the winner of every election.
+    """
+
+    if offsets is None:
+        if not n_agents or len(rankings) % (n_agents * n_alternatives) != 0:
+            raise ValueError("the rankings do not split into elections of n agents and m alternatives")
+        offsets = range(0, len(rankings) // n_alternatives + 1, n_agents)
+    elif offsets[-1] * n_alternatives != len(rankings):
+        raise ValueError("the offsets do not match the number of rankings")
+
+    if isinstance(rule, str):
+        score_vector = rule_score_vector(rule, n_alternatives)
+    elif len(rule) != n_alternatives:
+        raise ValueError(f"score vector {list(rule)} does not have length {n_alternatives}")
+    else:
+        score_vector = sorted(rule, reverse=True)  # the highest score goes to the most preferred alternative
+    totals = _batch_totals(rankings, n_alternatives, score_vector, offsets)
+    return _batch_winners(totals, rankings, n_alternatives, offsets, tie_break)[0]
+
+
+def _batch_totals(rankings, n_alternatives, score_vector, offsets):
+
+    """
+    Returns the scores of every alternative of every election of a stack (see evaluate_batch) in one flat list,
+    where the score of alternative a in election e is at e * m + a. The score vector is sorted from the highest score.
+    """
+
+    n_elections = len(offsets) - 1
+    if any(isinstance(score, Fraction) for score in score_vector):  # scaling exact fractions to integers, which are added much faster
+        scale = lcm(*(Fraction(score).denominator for score in score_vector))
+        score_vector = [int(score * scale) for score in score_vector]
+
+    election_base = array("Q")  # the key of alternative a of election e is e * m + a, so one tally holds every election
+    for election in range(n_elections):
+        election_base.extend(repeat(election * n_alternatives, offsets[election + 1] - offsets[election]))
+
+    common_score = Counter(score_vector).most_common(1)[0][0]  # as in _profile_scores, only the other positions are counted
+    totals = [0]
+    for election in range(n_elections):
+        totals.extend(repeat(common_score * (offsets[election + 1] - offsets[election]), n_alternatives))
+    for position, score in enumerate(score_vector):
+        if score != common_score:
+            counts = Counter(map(add, rankings[position::n_alternatives], election_base))
+            totals = list(map(add, totals, map(mul, map(counts.get, range(len(totals)), repeat(0)), repeat(score - common_score))))
+    return totals
+
+
+def _batch_winners(totals, rankings, n_alternatives, offsets, tie_break):
+
+    """
+    Returns the winner of every election of a stack from its scores (see _batch_totals),
+    and for every election whether its highest score was tied, so that a tie-break was needed.
+    """
+
+    options = tie_break.chain if isinstance(tie_break, TieBreaker) else tie_break if isinstance(tie_break, (list, tuple)) else [tie_break]
+    winners = []
+    tied = []
+    for election in range(len(offsets) - 1):
+        scores = totals[election * n_alternatives + 1:(election + 1) * n_alternatives + 1]
+        highest_score = max(scores)
+        is_tied = scores.count(highest_score) > 1
+        tied.append(is_tied)
+        if not is_tied or options[0] == "min":
+            winners.append(scores.index(highest_score) + 1)
+        elif options[0] == "max":
+            winners.append(n_alternatives - scores[::-1].index(highest_score))
+        else:  # the agents of the chain, numbered within the election
+            first = offsets[election]
+            size = offsets[election + 1] - first
+            preferences = {}
+            for agent in TieBreaker(None, options).agents():
+                if 1 <= agent <= size:
+                    start = (first + agent - 1) * n_alternatives
+                    preferences[agent] = list(rankings[start:start + n_alternatives])
+            possible_winners = [alternative for alternative, score in enumerate(scores, start=1) if score == highest_score]
+            winners.append(_break_tie(possible_winners, preferences, options))
+    return winners, tied
+
+
+_PERMUTATION_TABLES = {}  # the rankings of m alternatives and their inverse-rank arrays, built once for every small m
+
+
+def _impartial_culture_batch(n_agents, n_alternatives, seed=None):
+
+    """
+    Draws an impartial culture profile for simulate. When m is small, every agent draws the index of one of the m! rankings,
+    and the rankings and their inverse-rank arrays are copied from a table, so the profile needs no validation and no positions pass.
+    For the same seed, this is not the same profile as impartial_culture_profile.
+    """
+
+    if n_alternatives > 7:
+        return impartial_culture_profile(n_agents, n_alternatives, seed)
+    if n_alternatives not in _PERMUTATION_TABLES:
+        rankings_table = list(permutations(range(1, n_alternatives + 1)))
+        positions_table = [sorted(range(n_alternatives), key=ranking.__getitem__) for ranking in rankings_table]
+        _PERMUTATION_TABLES[n_alternatives] = (rankings_table, positions_table)
+    rankings_table, positions_table = _PERMUTATION_TABLES[n_alternatives]
+
+    drawn = random.Random(seed).choices(range(len(rankings_table)), k=n_agents)
+    typecode = _smallest_typecode(n_alternatives)
+    profile = PreferenceProfile(array(typecode, chain.from_iterable(map(rankings_table.__getitem__, drawn))), n_alternatives, validate=False)
+    profile._positions = array(typecode, chain.from_iterable(map(positions_table.__getitem__, drawn)))
+    return profile
+
+
+def _batch_pairwise(positions, n_alternatives, n_elections, n_agents):
+
+    """
+    Returns the majority matrix of every election of a batch of elections of n agents, from the inverse-rank arrays of all their agents.
+    Every pair of alternatives is compared in a single pass over all the elections, as in _add_pairwise.
+    """
+
+    columns = [positions[alternative::n_alternatives] for alternative in range(n_alternatives)]
+    election_of_agent = array("L", chain.from_iterable(repeat(election, n_agents) for election in range(n_elections)))
+    matrices = [[[0] * n_alternatives for alternative in range(n_alternatives)] for election in range(n_elections)]
+    for first in range(n_alternatives):
+        for second in range(first + 1, n_alternatives):
+            first_wins = Counter(keep_selected(election_of_agent, map(lt, columns[first], columns[second])))  # per election, the agents that rank first above second
+            for election, counts in enumerate(matrices):
+                wins = first_wins.get(election, 0)
+                counts[first][second] = wins
+                counts[second][first] = n_agents - wins
+    return matrices
+
+
+# cultures for simulate: every agent draws its ranking independently, so one profile of many agents splits into many elections
+SIMULATION_CULTURES = {
+    "impartial": _impartial_culture_batch,
+    "mallows": partial(mallows_profile, phi=0.5),
+    "single_peaked": single_peaked_profile,
+}
+
+
+class SimulationStats:
+
+    """
+    The statistics of a simulation, accumulated election by election in a fixed amount of memory.
+    Statistics of different batches are merged by adding them together.
+
+    PARAMETERS
+    -----------
+    rules: (list)
+        the rules compared (a score vector becomes a tuple).
+
+    ATTRIBUTES
+    -----------
+    n_elections: the number of elections simulated.
+    agreements: the matrix where agreements[i][j] is the number of elections where rules i and j have the same winner.
+    ties: the number of elections where each rule had several possible winners, so that the tie-breaking option decided.
+    condorcet_elections: the number of elections with a Condorcet winner.
+    condorcet_agreements: the number of those elections where each rule elects the Condorcet winner.
+    """
+
+    def __init__(self, rules):
+        self.rules = [rule if isinstance(rule, str) else tuple(rule) for rule in rules]
+        self.n_elections = 0
+        self.agreements = [[0] * len(self.rules) for rule in self.rules]
+        self.ties = dict.fromkeys(self.rules, 0)
+        self.condorcet_elections = 0
+        self.condorcet_agreements = dict.fromkeys(self.rules, 0)
+
+    def add_elections(self, winners, tied, condorcet_winners=None):
+
+        """
+        Adds a batch of elections: winners and tied map every rule to the list of its winners and of whether the election was tied,
+        and condorcet_winners is the list of the Condorcet winners (None for an election without one), if they were computed.
+        """
+
+        self.n_elections += len(winners[self.rules[0]])
+        for i, first in enumerate(self.rules):
+            self.ties[first] += sum(tied[first])
+            for j, second in enumerate(self.rules):
+                self.agreements[i][j] += sum(map(eq, winners[first], winners[second]))
+        if condorcet_winners is not None:
+            self.condorcet_elections += len(condorcet_winners) - condorcet_winners.count(None)
+            for rule in self.rules:
+                self.condorcet_agreements[rule] += sum(winner == condorcet_winner for winner, condorcet_winner in zip(winners[rule], condorcet_winners)
+                                                       if condorcet_winner is not None)
+
+    def __add__(self, other):
+        total = SimulationStats(self.rules)
+        total.n_elections = self.n_elections + other.n_elections
+        total.agreements = _add_matrices(self.agreements, other.agreements)
+        total.ties = {rule: self.ties[rule] + other.ties[rule] for rule in self.rules}
+        total.condorcet_elections = self.condorcet_elections + other.condorcet_elections
+        total.condorcet_agreements = {rule: self.condorcet_agreements[rule] + other.condorcet_agreements[rule] for rule in self.rules}
+        return total
+
+    def agreement_rates(self):
+
+        """
+        Returns the share of elections where every two rules have the same winner, as a dictionary of dictionaries.
+        """
+
+        return {first: {second: self.agreements[i][j] / max(self.n_elections, 1) for j, second in enumerate(self.rules)}
+                for i, first in enumerate(self.rules)}
+
+    def tie_rates(self):
+        return {rule: ties / max(self.n_elections, 1) for rule, ties in self.ties.items()}
+
+    def condorcet_efficiency(self):
+
+        """
+        Returns for every rule the share of the elections with a Condorcet winner where the rule elects it.
+        """
+
+        return {rule: agreements / max(self.condorcet_elections, 1) for rule, agreements in self.condorcet_agreements.items()}
+
+    def __repr__(self):
+        return f"SimulationStats(n_elections={self.n_elections}, rules={self.rules})"
+
+
+def _simulate_batch(n_elections, n_agents, n_alternatives, rules, culture, tie_break, seed, condorcet):
+
+    """
+    Simulates one batch of elections, in this process or in a worker process, and returns its SimulationStats.
+    The batch is drawn as one profile of n_elections x n_agents agents, and the positional rules are evaluated on all the elections at once.
+    """
+
+    if isinstance(culture, str):
+        culture = SIMULATION_CULTURES[culture]
+    profile = culture(n_elections * n_agents, n_alternatives, seed=seed)
+    rankings = profile.rankings
+    offsets = range(0, n_elections * n_agents + 1, n_agents)
+
+    stats = SimulationStats(rules)
+    winners = {}
+    tied = {}
+    for rule in stats.rules:
+        if rule != "STV" and rule not in PAIRWISE_RULES:
+            score_vector = rule_score_vector(rule, n_alternatives) if isinstance(rule, str) else sorted(rule, reverse=True)
+            totals = _batch_totals(rankings, n_alternatives, score_vector, offsets)
+            winners[rule], tied[rule] = _batch_winners(totals, rankings, n_alternatives, offsets, tie_break)
+        else:
+            winners[rule], tied[rule] = [], []
+
+    # the majority matrices are tallied for the whole batch, then STV, the pairwise rules and the Condorcet winners are found election by election
+    per_election = [rule for rule in stats.rules if rule == "STV" or rule in PAIRWISE_RULES]
+    condorcet_winners = [] if condorcet else None
+    if per_election or condorcet:
+        span = n_agents * n_alternatives
+        majorities = None
+        if condorcet or any(rule in PAIRWISE_RULES for rule in per_election):
+            majorities = _batch_pairwise(profile.positions, n_alternatives, n_elections, n_agents)
+        for election in range(n_elections):
+            preferences = PreferenceProfile(rankings[election * span:(election + 1) * span], n_alternatives, validate=False)
+            majority = None if majorities is None else majorities[election]
+            for rule in per_election:
+                if rule == "STV":
+                    possible_winners = stv_elimination(preferences)[0]
+                else:
+                    possible_winners = _pairwise_possible_winners(rule, majority)[1]
+                tied[rule].append(len(possible_winners) > 1)
+                winners[rule].append(_break_tie(possible_winners, preferences, tie_break) if possible_winners else None)
+            if condorcet:
+                wins = _majority_margins(majority)[0]
+                condorcet_winners.append(wins.index(n_alternatives - 1) + 1 if n_alternatives - 1 in wins else None)
+
+    stats.add_elections(winners, tied, condorcet_winners)
+    return stats
+
+
+def simulate(n_elections, n_agents, n_alternatives, rules=("plurality", "veto", "borda", "harmonic", "STV"), culture="impartial",
+             tie_break="min", batch_size=1000, seed=None, workers=1, condorcet=True):
+
+    """
+    Simulates many random elections and measures how often the rules agree on the winner, how often they need a tie-break,
+    and how often they elect the Condorcet winner. The elections are drawn and evaluated in batches of batch_size,
+    and only the counts of the statistics are kept from one batch to the next, so the memory does not grow with n_elections.
+    The same seed always gives the same statistics, whatever the number of workers.
+
+    PARAMETERS
+    -----------
+    n_elections: (int)
+        the number of elections to simulate.
+
+    n_agents: (int)
+        the number of agents in every election.
+
+    n_alternatives: (int)
+        the number of alternatives in every election.
+
+    rules: (list)
+        the rules to compare: plurality, veto, borda, harmonic, STV, condorcet, copeland and maximin by name,
+        and custom scoring rules by their score vector.
+
+    culture:
+        the name of a culture of SIMULATION_CULTURES (impartial, mallows, single_peaked), or a function (n_agents, n_alternatives, seed=seed)
+        that returns a PreferenceProfile where the agents draw their rankings independently.
+
+    tie_break:
+        an option for the tie-breaking among possible winners (max, min, an agent or a chain of them), used for every rule.
+        An agent is numbered within its election.
+
+    batch_size: (int)
+        the number of elections drawn and evaluated together.
+
+    seed: (int)
+        the seed of the simulation. Every batch gets its own seed drawn from it.
+
+    workers: (int)
+        the number of processes the batches are split across. With 1, everything runs in this process.
+
+    condorcet: (bool)
+        whether to find the Condorcet winner of every election, for the Condorcet efficiency of the rules.
+
+    RETURNS
+    -----------
+    a SimulationStats with the statistics of all the elections.
+    """
+
+    for rule in rules:  # checking every rule before anything is drawn
+        if isinstance(rule, str):
+            if rule != "STV" and rule not in PAIRWISE_RULES:
+                rule_score_vector(rule, n_alternatives)
+        elif len(rule) != n_alternatives:
+            raise ValueError(f"score vector {list(rule)} does not have length {n_alternatives}")
+    if n_elections < 1 or n_agents < 1 or batch_size < 1:
+        raise ValueError("the numbers of elections, agents and elections per batch must be positive")
+
+    rng = random.Random(seed)
+    batches = [(min(batch_size, n_elections - first), rng.getrandbits(64)) for first in range(0, n_elections, batch_size)]
+    arguments = [(size, n_agents, n_alternatives, rules, culture, tie_break, batch_seed, condorcet) for size, batch_seed in batches]
+
+    stats = SimulationStats(rules)
+    if workers == 1:
+        for batch in arguments:
+            stats += _simulate_batch(*batch)
+        return stats
+
+    from concurrent.futures import ProcessPoolExecutor  # only needed for the parallel mode
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        for batch_stats in pool.map(_simulate_batch, *zip(*arguments)):
+            stats += batch_stats
+    return stats
+
+
+_instrumentation = None  # the active Instrumentation, None while instrumentation is off
+
+
+class Instrumentation:
+
+    """
+    Opt-in instrumentation of the hot paths of the module. While it is active, the ingestion, the tallies, the STV rounds and the tie-breaking
+    report how long every phase took and how much work it did (rows read, ballots touched, STV rounds, tie-breaks), and the errors that
+    the rules recover from are reported as structured records instead of being printed. While it is off, every hook costs one test of a global.
+    It is turned on by instrument.
+
+    PARAMETERS
+    -----------
+    sinks: (list)
+        the objects the events are sent to, with the methods count(name, amount), timing(phase, seconds) and error(record),
+        such as CollectorSink, LoggingSink and PrometheusSink.
+    """
+
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+        self._previous = None  # the instrumentation that was active before this one, restored by stop
+        self.active = False
+
+    def count(self, name, amount=1):
+        for sink in self.sinks:
+            sink.count(name, amount)
+
+    def timing(self, phase, seconds):
+        for sink in self.sinks:
+            sink.timing(phase, seconds)
+
+    def error(self, record):
+        for sink in self.sinks:
+            sink.error(record)
+
+    def start(self):
+        global _instrumentation
+        if self.active:
+            return self
+        self._previous = _instrumentation
+        _instrumentation = self
+        self.active = True
+        return self
+
+    def stop(self):
+        global _instrumentation
+        if not self.active:  # stopping twice, or before starting, must not turn off another instrumentation
+            return
+        _instrumentation = self._previous
+        self.active = False
+
+    def __enter__(self):
+        return self.start()  # does nothing when instrument has started it already
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def instrument(*sinks):
+
+    """
+    Turns the instrumentation on, with the given sinks or with a new CollectorSink when none is given, and returns the Instrumentation.
+    Used in a with statement, it is turned off again at the end of the block; otherwise its stop method turns it off.
+    """
+
+    return Instrumentation(sinks or [CollectorSink()]).start()
+
+
+class _Phase:
+
+    """
+    Times a phase in a with statement and reports it to the active instrumentation.
+    """
+
+    __slots__ = ("instrumentation", "name", "start")
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.timing(self.name, time.perf_counter() - self.start)
+
+
+_NO_PHASE = nullcontext()  # what _phase returns while instrumentation is off, so that timing a phase then costs nothing
+
+
+def _phase(name):
+    return _NO_PHASE if _instrumentation is None else _Phase(_instrumentation, name)
+
+
+def _count(name, amount=1):
+    if _instrumentation is not None:
+        _instrumentation.count(name, amount)
+
+
+def _report_error(source, error, **details):
+
+    """
+    Reports an error that a rule recovers from (the rule then returns False or None, as it always did).
+    With instrumentation on, a record with the source, the type of the error, its message and the details is sent to the sinks;
+    otherwise the message is printed on the standard error, so that it never mixes with the output of a program.
+    """
+
+    if _instrumentation is None:
+        print(f"ERROR HAS OCCURED: {error}", file=sys.stderr)
+    else:
+        _instrumentation.error(dict(details, source=source, error=type(error).__name__, message=str(error)))
+
+
+def _n_ballots(preferences):
+    return preferences.n_ballots if isinstance(preferences, CompressedProfile) else len(preferences)
+
+
+class CollectorSink:
+
+    """
+    A sink that keeps the instrumentation in memory: the total of every counter, the number of calls and the total seconds of every phase,
+    and the list of the error records.
+    """
+
+    def __init__(self):
+        self.counters = Counter()
+        self.timings = {}  # phase: (calls, seconds)
+        self.errors = []
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def timing(self, phase, seconds):
+        calls, total = self.timings.get(phase, (0, 0.0))
+        self.timings[phase] = (calls + 1, total + seconds)
+
+    def error(self, record):
+        self.errors.append(record)
+
+    def clear(self):
+        self.counters.clear()
+        self.timings.clear()
+        self.errors.clear()
+
+
+class LoggingSink:
+
+    """
+    A sink that writes every event to a logger (the voting logger by default): counters and phases at the given level, errors at the error level.
+    """
+
+    def __init__(self, logger=None, level=None):
+        import logging  # only needed for this sink
+
+        self.logger = logger or logging.getLogger("voting")
+        self.level = logging.DEBUG if level is None else level
+
+    def count(self, name, amount=1):
+        self.logger.log(self.level, "%s +%s", name, amount)
+
+    def timing(self, phase, seconds):
+        self.logger.log(self.level, "%s took %.6f s", phase, seconds)
+
+    def error(self, record):
+        self.logger.error("%s: %s: %s", record["source"], record["error"], record["message"], extra={"voting_error": record})
+
+
+class PrometheusSink(CollectorSink):
+
+    """
+    A sink that collects like CollectorSink and dumps the totals in the Prometheus text format,
+    to be served by an exporter or written to the textfile directory of a node exporter.
+
+    PARAMETERS
+    -----------
+    prefix: (str)
+        the prefix of the names of the metrics.
+    """
+
+    def __init__(self, prefix="voting"):
+        super().__init__()
+        self.prefix = prefix
+
+    def dump(self):
+
+        """
+        Returns the counters, the phases and the errors as metrics in the Prometheus text format.
+        """
+
+        lines = []
+        for name in sorted(self.counters):
+            lines.append(f"# TYPE {self.prefix}_{name}_total counter")
+            lines.append(f"{self.prefix}_{name}_total {self.counters[name]}")
+        if self.timings:
+            for metric, index in (("phase_calls_total", 0), ("phase_seconds_total", 1)):
+                lines.append(f"# TYPE {self.prefix}_{metric} counter")
+                for phase in sorted(self.timings):
+                    lines.append(f'{self.prefix}_{metric}{{phase="{phase}"}} {self.timings[phase][index]}')
+        if self.errors:
+            lines.append(f"# TYPE {self.prefix}_errors_total counter")
+            for (source, error), total in sorted(Counter((record["source"], record["error"]) for record in self.errors).items()):
+                lines.append(f'{self.prefix}_errors_total{{source="{source}",error="{error}"}} {total}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+
+        """
+        Writes the dump to a file, replacing it at once so that a reader never sees half of it.
+        """
+
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as prometheus_file:
+            prometheus_file.write(self.dump())
+        os.replace(temporary, path)
+
+
+def _tie_favours(tie_break, challenger, winner):
+
+    """
+    Tells whether the tie-breaking option would select the challenger over the winner if they were tied.
+    None when it cannot be told from the alternatives alone, because an agent breaks the tie.
+    """
+
+    option = (tie_break.chain if isinstance(tie_break, TieBreaker) else tie_break if isinstance(tie_break, (list, tuple)) else [tie_break])[0]
+    if option == "min":
+        return challenger < winner
+    if option == "max":
+        return challenger > winner
+    return None
+
+
+def _greedy_margin(buckets, gap, strict):
+
+    """
+    Returns the smallest number of ballots whose gains add up to at least the gap (more than the gap when strict),
+    taking the ballots with the largest gain first, and the number taken from every bucket; None if all the ballots are not enough.
+    buckets is a list of (gain, key, count), where count ballots have the same gain.
+    """
+
+    total = 0
+    taken = []
+    n_ballots = 0
+    for gain, key, count in sorted(buckets, key=itemgetter(0), reverse=True):
+        if total > gap or total == gap and not strict:
+            break
+        if gain <= 0 or count <= 0:
+            break  # the ballots left cannot help
+        needed = (gap - total) // gain + 1 if strict else -(-(gap - total) // gain)
+        take = min(needed, count)
+        total += take * gain
+        n_ballots += take
+        taken.append((*key, take))
+    if total > gap or total == gap and not strict:
+        return n_ballots, taken
+    return None, None
+
+
+def _positional_margins(preferences, score_vector, tie_break):
+
+    """
+    The margin of a positional rule against every other alternative (see margin_of_victory).
+    """
+
+    score_vector = sorted(score_vector, reverse=True)
+    scores = positional_winner(preferences, score_vector, tie_break, output="scores")  # the scores the rule itself compares, float ones included
+    highest_score = max(scores.values())
+    winner = _break_tie([alternative for alternative, score in scores.items() if score == highest_score], preferences, tie_break)
+    if winner is False:
+        raise ValueError(f"the tie-breaking option {tie_break!r} does not correspond to an agent")
+    weights = None
+    if isinstance(preferences, CompressedProfile):  # the joint counts are taken over the distinct ballots only
+        weights = preferences.counts
+        preferences = preferences.ballots
+    if not isinstance(preferences, PreferenceProfile):
+        preferences = PreferenceProfile.from_dict(preferences)
+    n_alternatives = preferences.n_alternatives
+
+    # joint[(i, c, j)]: the number of ballots with the winner at position i and alternative c at position j
+    winner_positions = preferences.positions[winner - 1::n_alternatives]
+    joint = Counter()
+    for position in range(n_alternatives):
+        column = preferences.rankings[position::n_alternatives]
+        if weights is None:
+            pairs = Counter(zip(winner_positions, column))
+        else:
+            pairs = Counter()
+            for pair, weight in zip(zip(winner_positions, column), weights):
+                pairs[pair] += weight
+        for (winner_position, alternative), count in pairs.items():
+            joint[(winner_position, alternative, position)] += count
+
+    # the margins are counted with exact scores, taken from the joint counts: the winner is at position i whenever alternative c = winner is at j = i
+    score_vector = [_exact(score) for score in score_vector]
+    exact_scores = Counter()
+    for (winner_position, alternative, position), count in joint.items():
+        exact_scores[alternative] += count * score_vector[position]
+
+    best_swing = score_vector[0] - score_vector[-1]  # a changed ballot puts the runner-up first and the winner last
+    runners_up = {}
+    for challenger in range(1, n_alternatives + 1):
+        if challenger == winner:
+            continue
+        buckets = [(score_vector[winner_position] - score_vector[position] + best_swing, (winner_position + 1, position + 1), count)
+                   for (winner_position, alternative, position), count in joint.items() if alternative == challenger]
+        gap = exact_scores[winner] - exact_scores[challenger]
+        favours = _tie_favours(tie_break, challenger, winner)
+        rounded = gap < 0 or gap == 0 and favours  # the winner only leads by float rounding, so the challenger needs a strict gain
+        gap = max(gap, 0)
+        margin, coalition = _greedy_margin(buckets, gap, strict=rounded or not favours)
+        lower_bound = margin if favours is not None else _greedy_margin(buckets, gap, strict=rounded)[0]
+        ballot = [challenger] + [alternative for alternative in range(1, n_alternatives + 1) if alternative not in (challenger, winner)] + [winner]
+        runners_up[challenger] = {"margin": margin, "lower_bound": lower_bound, "coalition": coalition, "ballot": ballot}
+    return winner, runners_up
+
+
+def _stv_loses(counts, winner, challenger, k, tie_break):
+
+    """
+    Tells whether the winner is eliminated in the round with these counts, or loses the final tie,
+    after k ballots move from the winner to the challenger.
+    """
+
+    moved = dict(counts)
+    moved[winner] -= k
+    moved[challenger] += k
+    lowest = min(moved.values())
+    if moved[winner] > lowest:
+        return False
+    if max(moved.values()) > lowest:  # the winner is among the alternatives eliminated in this round
+        return True
+    # every remaining alternative is tied, so the winner loses if the tie-breaking selects another one (counted as not when an agent breaks the tie)
+    return any(_tie_favours(tie_break, alternative, winner) for alternative in moved if alternative != winner)
+
+
+def _stv_margins(preferences, tie_break):
+
+    """
+    The bounds on the margin of STV against every other alternative (see margin_of_victory).
+    """
+
+    possible_winners, trace = stv_elimination(preferences)
+    winner = _break_tie(possible_winners, preferences, tie_break)
+    if winner is False:
+        raise ValueError(f"the tie-breaking option {tie_break!r} does not correspond to an agent")
+    first_places = trace[0][0].get(winner, 0)  # the ballots that count for the winner in every round
+
+    # lower bound: a ballot changes the difference between two counts by at most 2, so fewer changes than half the smallest gap
+    # between the alternatives eliminated in a round and the ones that survive it leave every round, and the winner, as they are
+    lower_bound = None
+    for counts, removed in trace[:-1]:
+        survivors = [count for alternative, count in counts.items() if alternative not in removed]
+        bound = 1 if len(removed) > 1 else max(1, -(-(min(survivors) - counts[removed[0]]) // 2))
+        lower_bound = bound if lower_bound is None else min(lower_bound, bound)
+    if len(possible_winners) > 1:
+        lower_bound = 1
+
+    # upper bound against every challenger: moving k ballots that rank the winner first to the challenger first only lowers the count
+    # of the winner and raises the one of the challenger in every round, so the rounds stay the same until the winner is eliminated
+    runners_up = {}
+    alternatives = sorted(trace[0][0])
+    for challenger in alternatives:
+        if challenger == winner:
+            continue
+        margin = None
+        for counts, removed in trace:
+            if challenger not in counts:
+                break  # the challenger is eliminated, so moving ballots to it changes the later rounds
+            # the smallest k that brings the winner down to the challenger and to the lowest other count, in closed form;
+            # if that leaves every alternative tied and the tie-breaking keeps the winner, one more ballot puts it strictly below the challenger
+            lowest_other = min((count for alternative, count in counts.items() if alternative not in (winner, challenger)), default=counts[winner])
+            k = max(0, -(-(counts[winner] - counts[challenger]) // 2), counts[winner] - lowest_other)
+            if not _stv_loses(counts, winner, challenger, k, tie_break):
+                k += 1
+            if k <= first_places and (margin is None or k < margin):
+                margin = k
+        ballot = [challenger] + [alternative for alternative in alternatives if alternative not in (challenger, winner)] + [winner]
+        runners_up[challenger] = {"margin": margin, "lower_bound": lower_bound, "coalition": None if margin is None else [(1, None, margin)], "ballot": ballot}
+    return winner, runners_up, lower_bound
+
+
+def margin_of_victory(preferences, rule, tie_break):
+
+    """
+    Measures how robust the winner of a rule is: the smallest number of ballots that, if they were changed, would give another winner.
+    For every other alternative (every runner-up), it reports how many ballots must change for the runner-up to beat the winner,
+    which ballots (the cheapest coalition) and what they must be changed to.
+
+    For a positional rule, the ballots only matter through the positions of the winner and of the runner-up, so they are counted
+    by those two positions in one pass over the profile (over the distinct ballots of a CompressedProfile), and the ballots with the largest
+    gain for the runner-up are changed first. The cost then depends on m, not on the number of ballots, and the margin is exact
+    (with an agent tie-breaking, a tie is counted as lost by the runner-up, and lower_bound counts it as won).
+    With float scores, the winner is the one the rule gives, and the margins are counted with the exact scores.
+    For STV, computing the margin exactly is hard, so it is bounded from the elimination trace of one run: the margin against a runner-up
+    is the fewest ballots that rank the winner first and, moved to the runner-up, get the winner eliminated in some round while the runner-up
+    is still in, and lower_bound is half the smallest gap between the alternatives eliminated in a round and the ones that survive it.
+
+    PARAMETERS
+    -----------
+    preferences: (dict, PreferenceProfile or CompressedProfile)
+        A preference profile represented by a dictionary, a PreferenceProfile or a CompressedProfile.
+
+    rule:
+        plurality, veto, borda, harmonic or STV by name, or the score vector of a custom scoring rule.
+
+    tie_break:
+        an option for the tie-breaking among possible winners (max, min, an agent or a chain of them, see TieBreaker).
+
+    RETURNS
+    -----------
+    a dictionary with
+        winner: the winner of the rule,
+        margin: the smallest margin against a runner-up (an upper bound for STV), None when no change of ballots gives another winner,
+        lower_bound: a number of changed ballots below which the winner cannot change,
+        runners_up: for every other alternative, a dictionary with its margin and lower_bound, the coalition as a list of
+            (winner position, runner-up position, number of ballots) to change (the runner-up position is None for STV, where
+            any ballot with the winner first will do), and the ballot to change them to.
+    """
+
+    if rule == "STV":
+        winner, runners_up, lower_bound = _stv_margins(preferences, tie_break)
+    else:
+        n_alternatives = len(preferences[1])
+        if isinstance(rule, str):
+            score_vector = rule_score_vector(rule, n_alternatives)
+        elif len(rule) != n_alternatives:
+            raise ValueError(f"score vector {list(rule)} does not have length {n_alternatives}")
+        else:
+            score_vector = rule
+        winner, runners_up = _positional_margins(preferences, score_vector, tie_break)
+        lower_bound = min((result["lower_bound"] for result in runners_up.values() if result["lower_bound"] is not None), default=None)
+
+    margin = min((result["margin"] for result in runners_up.values() if result["margin"] is not None), default=None)
+    return {"winner": winner, "margin": margin, "lower_bound": lower_bound, "runners_up": runners_up}
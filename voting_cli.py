@@ -0,0 +1,161 @@
+# command-line batch runner for the voting rules in voting.py
+
+import argparse
+import os
+import sys
+
+# voting, json and the process pool are imported only once the arguments are parsed, so --help and argument errors come back at once
+
+VALUATION_EXTENSIONS = (".csv", ".xlsx")
+
+RULES = ("plurality", "veto", "borda", "harmonic", "STV", "condorcet", "copeland", "maximin", "range_voting")
+
+
+def find_files(paths):
+
+    """
+    Yields the valuation files given on the command line, and the csv and xlsx files found under the directories given, in sorted order.
+    """
+
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for directory, subdirectories, file_names in os.walk(path):
+            subdirectories.sort()
+            for file_name in sorted(file_names):
+                if file_name.lower().endswith(VALUATION_EXTENSIONS) and not file_name.startswith("~$"):  # skipping the lock files of Excel
+                    yield os.path.join(directory, file_name)
+
+
+def parse_tie_break(option):
+
+    """
+    Turns a tie-breaking option of the command line into one of voting.py: min, max, an agent number, or a chain of them joined by commas.
+    """
+
+    chain = [part if part in ("min", "max") else int(part) for part in option.split(",")]
+    return chain[0] if len(chain) == 1 else chain
+
+
+def parse_score_vector(option):
+    return [int(score) if score.lstrip("-").isdigit() else float(score) for score in option.split(",")]
+
+
+def process_file(path, rules, score_vectors, tie_breaks):
+
+    """
+    Evaluates the rules and score vectors on the valuations of one file, for every tie-breaking option.
+    The file is read once into a CompressedProfile, every positional and pairwise rule then shares one scan of it (see voting.evaluate_all),
+    and range_voting, which works on the valuations themselves, reads the file again.
+    The rules run under a voting.CollectorSink, so the errors they recover from go into the records and nothing is written to the standard output.
+
+    RETURNS
+    -----------
+    a list with one record (a dictionary) per tie-breaking option, holding the winner of every rule; a score vector is named by its scores
+    joined by commas. A tie-breaking option with an agent that the file does not have, or under which a rule reported an error,
+    gives a record holding the error instead. If the file cannot be processed, a single record holding the error.
+    """
+
+    import time
+    import voting
+
+    start = time.perf_counter()
+    try:
+        profile = voting.generate_preferences(path, compress=True)
+        profile_rules = [rule for rule in rules if rule != "range_voting"] + score_vectors
+        records = []
+        for tie_break in tie_breaks:
+            missing = [agent for agent in voting.TieBreaker(profile, tie_break).agents() if not 1 <= agent <= profile.n_agents]
+            if missing:
+                records.append({"file": path, "tie_break": tie_break, "error": f"the file has no agent {missing[0]} (it has {profile.n_agents} agents)"})
+                continue
+            collector = voting.CollectorSink()
+            with voting.instrument(collector):
+                results = voting.evaluate_all(profile, profile_rules, tie_break) if profile_rules else {}
+                winners = {rule if isinstance(rule, str) else ",".join(map(str, rule)): winner for rule, (winner, scores) in results.items()}
+                if "range_voting" in rules:
+                    winners["range_voting"] = voting.range_voting(path, tie_break)
+            record = {"file": path, "tie_break": tie_break, "n": profile.n_agents, "m": profile.n_alternatives, "winners": winners}
+            if collector.errors:
+                record["error"] = "; ".join(f"{error['source']}: {error['message']}" for error in collector.errors)
+            records.append(record)
+    except Exception as error:  # one bad file must not stop the batch
+        return [{"file": path, "error": f"{type(error).__name__}: {error}"}]
+    seconds = time.perf_counter() - start
+    for record in records:
+        record["seconds"] = seconds
+    return records
+
+
+def run(paths, rules, score_vectors, tie_breaks, workers, output):
+
+    """
+    Processes the files across workers processes, writing every record to output as one JSON line as soon as its file is done,
+    so the lines come in the order the files finish. With one worker, the files are processed in this process, without a pool.
+    Returns the number of files that could not be processed.
+    """
+
+    import json
+
+    failures = 0
+
+    def write(records):
+        nonlocal failures
+        failures += any("error" in record for record in records)
+        for record in records:
+            output.write(json.dumps(record) + "\n")
+        output.flush()
+
+    if workers == 1:
+        for path in paths:
+            write(process_file(path, rules, score_vectors, tie_breaks))
+        return failures
+
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for path in paths:  # a few files per worker are queued at a time, so a directory of thousands of files is never submitted at once
+            if len(pending) >= 4 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(future.result())
+            pending.add(executor.submit(process_file, path, rules, score_vectors, tie_breaks))
+        for future in wait(pending).done:
+            write(future.result())
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate voting rules on many csv or xlsx valuation files and stream the winners as JSON lines.")
+    parser.add_argument("paths", nargs="+", help="valuation files, or directories searched for csv and xlsx files")
+    parser.add_argument("--rules", nargs="*", choices=RULES, default=["plurality", "borda", "STV"])
+    parser.add_argument("--score-vector", action="append", default=[], metavar="SCORES",
+                        help="scores of a custom scoring rule joined by commas, such as 3,2,1,0 (can be repeated)")
+    parser.add_argument("--tie-break", action="append", metavar="OPTION",
+                        help="min, max, an agent number, or a chain of them joined by commas (can be repeated, min by default)")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (the number of cores by default)")
+    parser.add_argument("--output", default="-", help="JSON lines file to write, - for standard output")
+    args = parser.parse_args(argv)
+
+    try:
+        tie_breaks = [parse_tie_break(option) for option in args.tie_break or ["min"]]
+        score_vectors = [parse_score_vector(option) for option in args.score_vector]
+    except ValueError as error:
+        parser.error(str(error))
+    if not args.rules and not score_vectors:
+        parser.error("there must be at least one rule or score vector")
+
+    paths = find_files(args.paths)
+    workers = args.workers or os.cpu_count() or 1
+    if args.output == "-":
+        failures = run(paths, args.rules, score_vectors, tie_breaks, workers, sys.stdout)
+    else:
+        with open(args.output, "w") as output:
+            failures = run(paths, args.rules, score_vectors, tie_breaks, workers, output)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,275 @@
+# asyncio front end for the voting rules in voting.py
+
+import asyncio
+import os
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import voting
+
+
+RULES = ("dictatorship", "scoring_rule", "plurality", "veto", "borda", "harmonic", "STV",
+         "condorcet", "copeland", "maximin", "range_voting", "evaluate_all")
+
+BATCH_RULES = ("plurality", "veto", "borda", "harmonic")  # the named rules that evaluate_batch can run, besides score vectors
+
+
+class ServiceOverloaded(RuntimeError):
+
+    """
+    Raised when a request arrives while every slot of the service is busy and the waiting line is full.
+    """
+
+
+def _run_rule(name, preferences, args, kwargs):
+
+    """
+    Runs a rule of voting.py in a worker thread or process. A memory-mapped profile is sent as ("mapped", path) and mapped again here.
+    """
+
+    if isinstance(preferences, tuple) and preferences[0] == "mapped":
+        preferences = voting.load_profile(preferences[1])
+    return getattr(voting, name)(preferences, *args, **kwargs)
+
+
+class ElectionService:
+
+    """
+    An asyncio front end for the voting rules. Every rule is an async method (await service.borda(preferences, tie_break)) whose work runs
+    in a thread or process pool, so the event loop is never blocked. On top of that, the service
+        - coalesces concurrent identical requests: while a rule runs on a profile, the same request on a profile with the same content
+          (see voting.profile_fingerprint) or on the same file waits for that run instead of starting another one,
+        - micro-batches small elections: evaluate gathers the small elections under the same positional rule and tie-breaking option
+          for up to batch_delay seconds and runs them as one call of voting.evaluate_batch,
+        - applies backpressure: at most max_concurrency calls run at a time, at most max_waiting requests wait for a slot,
+          and any other request is refused at once with ServiceOverloaded.
+
+    PARAMETERS
+    -----------
+    workers: (int)
+        the number of threads or processes of the pool (the number of cores by default).
+
+    processes: (bool)
+        if True, the work runs in a process pool, which uses several cores; the profiles are then pickled to the workers,
+        except the memory-mapped ones (see voting.load_profile), which the workers map again from their file.
+
+    executor:
+        an executor to use instead of creating one; it is not shut down by close.
+
+    max_concurrency: (int)
+        the largest number of calls running in the pool at a time (twice the number of workers by default).
+
+    max_waiting: (int)
+        the largest number of requests waiting for a slot.
+
+    batch_size: (int)
+        the largest number of elections in a micro-batch.
+
+    batch_delay: (float)
+        how long, in seconds, the first election of a micro-batch waits for others.
+
+    batch_max_agents: (int)
+        the largest number of agents of an election that is micro-batched.
+    """
+
+    def __init__(self, workers=None, processes=False, executor=None, max_concurrency=None, max_waiting=1000,
+                 batch_size=256, batch_delay=0.001, batch_max_agents=64):
+        workers = workers or os.cpu_count() or 1
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=workers) if processes else ThreadPoolExecutor(max_workers=workers)
+        self.executor = executor
+        self.processes = isinstance(executor, ProcessPoolExecutor)
+        self.max_concurrency = max_concurrency or 2 * workers
+        self.max_waiting = max_waiting
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.batch_max_agents = batch_max_agents
+
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._running = 0
+        self._waiting = 0
+        self._tasks = set()  # the runs of the micro-batches
+        self._in_flight = {}  # the future of every running request, by request key
+        self._batches = {}  # the elections waiting for every micro-batch, by rule, number of alternatives and tie-breaking option
+        self.counters = dict.fromkeys(("requests", "coalesced", "batched", "batches", "rejected"), 0)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+
+        """
+        Runs the micro-batches that are still waiting and shuts the pool down, if the service created it.
+        """
+
+        for key in list(self._batches):
+            self._flush(key)
+        while self._in_flight or self._tasks:
+            await asyncio.gather(*self._in_flight.values(), *self._tasks, return_exceptions=True)
+        if self._owns_executor:
+            self.executor.shutdown(wait=True)
+
+    def stats(self):
+        return dict(self.counters, running=self._running, waiting=self._waiting)
+
+    async def _offload(self, function, *args):
+
+        """
+        Runs a function in the pool once a slot is free, refusing the request if too many requests are waiting already.
+        """
+
+        if self._slots.locked() and self._waiting >= self.max_waiting:
+            self.counters["rejected"] += 1
+            raise ServiceOverloaded(f"{self._waiting} requests are already waiting for one of the {self.max_concurrency} slots")
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self._running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        finally:
+            self._running -= 1
+            self._slots.release()
+
+    async def _coalesced(self, key, work):
+
+        """
+        Awaits work() for the first request with this key, and makes the requests with the same key that arrive while it runs wait for its result.
+        """
+
+        if key in self._in_flight:
+            self.counters["coalesced"] += 1
+            return await asyncio.shield(self._in_flight[key])
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await work()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            future.exception()  # marking the exception as retrieved, so asyncio does not warn when no other request was waiting
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._in_flight[key]
+        return result
+
+    async def _profile_key(self, preferences):
+
+        """
+        Returns what identifies a profile between requests: its fingerprint, or the path, modification time and size of a file.
+        A large profile is fingerprinted in a thread the first time, so the event loop is not blocked.
+        """
+
+        if isinstance(preferences, (str, os.PathLike)):
+            stat = os.stat(preferences)
+            return ("file", os.fspath(preferences), stat.st_mtime_ns, stat.st_size)
+        if isinstance(preferences, Mapping):
+            if len(preferences) > 10000 and getattr(preferences, "_fingerprint", None) is None:
+                return ("profile", await asyncio.to_thread(voting.profile_fingerprint, preferences))
+            return ("profile", voting.profile_fingerprint(preferences))
+        return ("object", id(preferences))  # a worksheet, which stays alive while its request runs
+
+    def _shippable(self, preferences):
+        if self.processes and isinstance(preferences, Mapping) and getattr(preferences, "path", None) is not None:
+            return ("mapped", preferences.path)
+        return preferences
+
+    async def submit(self, name, preferences, *args, **kwargs):
+
+        """
+        Runs the rule of voting.py called name on the profile (or the valuations, for range_voting) with the other arguments,
+        in the pool, coalescing it with the identical requests that are running.
+        """
+
+        if name not in RULES:
+            raise ValueError(f"{name} is not a rule of the service")
+        self.counters["requests"] += 1
+        key = (name, await self._profile_key(preferences), repr((args, sorted(kwargs.items()))))
+        return await self._coalesced(key, lambda: self._offload(_run_rule, name, self._shippable(preferences), args, kwargs))
+
+    async def evaluate(self, preferences, rule, tie_break):
+
+        """
+        Returns the winner of one rule, given by name (or by its score vector for a custom scoring rule).
+        An election with at most batch_max_agents agents under plurality, veto, borda, harmonic or a score vector is micro-batched
+        with the other small elections under the same rule; any other election is submitted on its own.
+        """
+
+        if isinstance(rule, str) and rule not in BATCH_RULES or len(preferences) > self.batch_max_agents:
+            if isinstance(rule, str):
+                return await self.submit(rule, preferences, tie_break)
+            return await self.submit("scoring_rule", preferences, list(rule), tie_break)
+
+        self.counters["requests"] += 1
+        n_alternatives = len(preferences[1])
+        rule_key = voting._rule_key(rule)
+        tie_break_key = voting._tie_break_key(tie_break)
+        key = ("evaluate", await self._profile_key(preferences), rule_key, tie_break_key)
+        return await self._coalesced(key, lambda: self._batched((rule_key, n_alternatives, tie_break_key), preferences, rule, tie_break))
+
+    async def _batched(self, batch_key, preferences, rule, tie_break):
+        batch = self._batches.get(batch_key)
+        if batch is None:
+            batch = self._batches[batch_key] = {"rule": rule, "tie_break": tie_break, "elections": [], "futures": [],
+                                                "timer": asyncio.get_running_loop().call_later(self.batch_delay, self._flush, batch_key)}
+        future = asyncio.get_running_loop().create_future()
+        batch["elections"].append(preferences)
+        batch["futures"].append(future)
+        self.counters["batched"] += 1
+        if len(batch["elections"]) >= self.batch_size:
+            self._flush(batch_key)
+        return await future
+
+    def _flush(self, batch_key):
+
+        """
+        Starts the run of a micro-batch. The elections are stacked here, which takes little time, so only arrays are sent to the pool.
+        """
+
+        batch = self._batches.pop(batch_key, None)
+        if batch is None:
+            return
+        batch["timer"].cancel()
+        self.counters["batches"] += 1
+        futures = batch["futures"]
+
+        async def run():
+            try:
+                rankings, n_alternatives, offsets = voting.stack_elections(batch["elections"])
+                winners = await self._offload(voting.evaluate_batch, rankings, n_alternatives, batch["rule"], batch["tie_break"], None, offsets)
+            except Exception as error:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(error)
+                return
+            for future, winner in zip(futures, winners):
+                if not future.done():
+                    future.set_result(winner)
+
+        task = asyncio.get_running_loop().create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+def _async_rule(name):
+
+    async def rule(self, preferences, *args, **kwargs):
+        return await self.submit(name, preferences, *args, **kwargs)
+
+    rule.__name__ = rule.__qualname__ = name
+    rule.__doc__ = f"Runs voting.{name} in the pool of the service (see ElectionService.submit) and returns its result."
+    return rule
+
+
+for _name in RULES:
+    setattr(ElectionService, _name, _async_rule(_name))